@@ -0,0 +1,82 @@
+import hashlib
+import hmac
+import os
+import time
+from ledger import LedgerError, business_account, to_cents
+
+PASSWORD_ITERATIONS = 200000
+
+
+class UsernameTaken(LedgerError):
+    pass
+
+
+def hash_password(password, salt):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_ITERATIONS).hex()
+
+
+class BusinessDirectory:
+    # Business logins keyed by username in the ledger database, so a login is a single
+    # primary-key lookup no matter how many merchants are registered. Passwords are stored
+    # as salted PBKDF2 hashes.
+    def __init__(self, ledger, business_folder="business"):
+        self.ledger = ledger
+        self.ledger.connection.execute("""
+            CREATE TABLE IF NOT EXISTS business_logins (
+                username TEXT PRIMARY KEY,
+                business_name TEXT NOT NULL UNIQUE,
+                salt TEXT NOT NULL,
+                password_hash TEXT NOT NULL
+            )
+        """)
+        if self.ledger.get_meta("business_logins_imported") is None:
+            self.import_business_files(business_folder)
+
+    def register(self, business_name, username, password):
+        salt = os.urandom(16)
+        with self.ledger.transaction() as connection:
+            row = connection.execute("SELECT 1 FROM business_logins WHERE username = ? OR business_name = ?",
+                                     (username, business_name)).fetchone()
+            if row is not None:
+                raise UsernameTaken(username)
+            connection.execute("INSERT INTO business_logins (username, business_name, salt, password_hash) "
+                               "VALUES (?, ?, ?, ?)", (username, business_name, salt.hex(), hash_password(password, salt)))
+            connection.execute("INSERT OR IGNORE INTO accounts (id, kind, balance) VALUES (?, 'business', 0)",
+                               (business_account(business_name),))
+
+    def authenticate(self, username, password):
+        # Returns the business name for valid credentials, None otherwise
+        row = self.ledger.connection.execute(
+            "SELECT business_name, salt, password_hash FROM business_logins WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        business_name, salt, password_hash = row
+        if not hmac.compare_digest(hash_password(password, bytes.fromhex(salt)), password_hash):
+            return None
+        return business_name
+
+    def import_business_files(self, business_folder="business"):
+        # One-off migration of business/<name>.txt (name, username, password, balance).
+        # When usernames clash the first file in name order wins, as with the old scan.
+        logins = []
+        accounts = []
+        if os.path.isdir(business_folder):
+            for filename in sorted(os.listdir(business_folder)):
+                if not filename.endswith(".txt"):
+                    continue
+                with open(os.path.join(business_folder, filename), "r") as file:
+                    data = file.read().splitlines()
+                if len(data) < 4:
+                    continue
+                salt = os.urandom(16)
+                logins.append((data[1], data[0], salt.hex(), hash_password(data[2], salt)))
+                accounts.append((business_account(data[0]), to_cents(data[3])))
+
+        with self.ledger.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO business_logins (username, business_name, salt, password_hash) "
+                                   "VALUES (?, ?, ?, ?)", logins)
+            connection.executemany("INSERT OR IGNORE INTO accounts (id, kind, balance) VALUES (?, 'business', ?)",
+                                   accounts)
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('business_logins_imported', ?)",
+                               (str(time.time()),))
+        return len(logins)
@@ -2,14 +2,25 @@ import sys
 import cv2
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, \
     QMessageBox, QInputDialog
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QImage, QPixmap
-from imutils.video import VideoStream
-import imutils
+from PyQt5.QtCore import Qt
 import os
 import random
 import string
+import time
 import face_recognition
+from detection import FaceDetector, face_quality
+from face_cache import FaceEncodingCache, image_key
+from frame_buffers import FramePipeline
+from frame_scheduler import FrameScheduler
+from gallery_journal import GalleryJournal
+from ledger import Ledger, LedgerError
+from ledger_writer import LedgerResults, LedgerWriter
+from metrics import metrics
+from recognition import FaceRecognizer
+from recognition_daemon import open_gallery, open_video_stream
+from recognition_worker import RecognitionWorker
+from startup import startup_timer
+from track_cache import TrackIdentityCache
 
 
 class POSApp(QMainWindow):
@@ -47,88 +58,91 @@ class POSApp(QMainWindow):
 
         self.layout.addLayout(self.button_layout)
 
-        # Load known faces and balances from the "faces" and "balances" folders
-        self.known_faces, self.face_balances = self.load_known_faces_and_balances("faces", "balances")
+        # Balances live in the ledger database, older text files are imported on first use
+        self.ledger = Ledger(balances_folder="balances")
+        startup_timer.mark("bank: ledger opened")
 
-        # Initialize the video stream
-        self.video_stream = VideoStream(src=0).start()
+        # Postings are committed in groups on a writer thread, the popups follow once they're durable
+        self.ledger_writer = LedgerWriter()
+        self.ledger_writer.start()
+        self.ledger_results = LedgerResults(self)
 
-        # Set up a timer to update the camera feed
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_camera)
-        self.timer.start(30)  # Update every 30 milliseconds
+        # Load known faces from the "faces" folder, balances are always read from the ledger
+        # so updates made by other terminals are never overwritten by a stale copy
+        self.gallery = self.load_known_faces("faces")
+        startup_timer.mark("bank: gallery loaded")
+
+        # Initialize the video stream, shared through the recognition daemon when it owns the camera
+        self.video_stream = open_video_stream()
+        startup_timer.mark("bank: camera started")
 
         # Variable to store the currently detected face
         self.current_face = None
 
-    def load_known_faces_and_balances(self, faces_folder, balances_folder):
-        known_faces = []
-        face_balances = {}
+        # Face detection settings for this terminal
+        self.detector = FaceDetector(scale=0.5, detect_every=3, model="hog", upsample=1)
 
-        for filename in os.listdir(faces_folder):
-            if filename.endswith(".jpg") or filename.endswith(".png"):
-                face_name = os.path.splitext(filename)[0]
-                face_image = cv2.imread(os.path.join(faces_folder, filename))
+        # Identities of faces that stay in view are cached per track instead of re-encoded
+        self.track_cache = TrackIdentityCache(tolerance=self.gallery.tolerance)
+        self.recognizer = FaceRecognizer(self.gallery, self.detector, self.track_cache)
 
-                # Check if face_encodings list is not empty before accessing its first element
-                face_encodings = face_recognition.face_encodings(face_image)
-                if not face_encodings:
-                    print(f"No face found in {filename}")
-                    continue
+        # Frames are resized and converted into pooled buffers shared by the preview and
+        # recognition, the worker hands each buffer back when it's done with it
+        self.frame_pipeline = FramePipeline(width=800)
 
-                encoding = face_encodings[0]
-                known_faces.append({"encoding": encoding, "name": face_name})
+        # Recognition runs on a worker thread so the preview never waits for it
+        self.recognition_worker = RecognitionWorker(self.recognize_faces, self, self.frame_pipeline.release)
+        self.recognition_worker.faces_recognized.connect(self.handle_recognized_faces)
+        self.recognition_worker.start()
 
-                # Load face balances from the "balances" folder
-                balance_filename = face_name + "_balance.txt"
-                balance_path = os.path.join(balances_folder, balance_filename)
-                if os.path.exists(balance_path):
-                    with open(balance_path, 'r') as balance_file:
-                        face_balances[face_name] = float(balance_file.read())
-                else:
-                    face_balances[face_name] = 0.0
+        # Update the camera feed every 30 milliseconds at best, slower when the ticks get
+        # expensive and at 2 fps while nobody is in front of the camera
+        self.scheduler = FrameScheduler(self.update_camera, self, preview_interval=30,
+                                        recognition_interval=100, worker=self.recognition_worker)
+        self.scheduler.start()
 
-        return known_faces, face_balances
+    def load_known_faces(self, faces_folder):
+        # The gallery is served by the recognition daemon when one is running, otherwise
+        # it's loaded from the shared on-disk cache and follows the change journal. Accounts
+        # are opened where faces are enrolled, so startup never walks every ID
+        gallery, self.gallery_watcher = open_gallery(faces_folder)
+        return gallery
 
     def update_camera(self):
-        # Read a frame from the video stream
-        frame = self.video_stream.read()
+        with metrics.span("update_camera"):
+            # Read a frame from the video stream
+            frame = self.video_stream.read()
 
-        # Resize the frame for better performance
-        frame = imutils.resize(frame, width=800)
+            # Resize and convert to RGB into a reused buffer
+            image = self.frame_pipeline.process(frame)
 
-        # Convert the OpenCV frame to QImage
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = image.shape
-        bytes_per_line = ch * w
-        q_image = QImage(image.data, w, h, bytes_per_line, QImage.Format_RGB888)
+            # Display the buffer in the QLabel
+            self.camera_label.setPixmap(self.frame_pipeline.preview(image))
 
-        # Display the QImage in the QLabel
-        pixmap = QPixmap.fromImage(q_image)
-        self.camera_label.setPixmap(pixmap)
-
-        # Recognize faces in the frame
-        recognized_faces = self.recognize_faces(frame)
+            # Hand the same RGB buffer to the recognition worker when the scheduler asks for
+            # a recognition, results arrive in handle_recognized_faces
+            if self.scheduler.should_recognize(image):
+                self.recognition_worker.submit(image)
+            else:
+                self.frame_pipeline.release(image)
+        metrics.count("frames_processed")
+
+    def recognize_faces(self, rgb_frame):
+        # Called on the recognition worker thread, must not touch any widgets
+        with metrics.span("recognize_faces"):
+            tracks = self.recognizer.recognize(rgb_frame)
+        return [track.name if track.name is not None else "Unknown" for track in tracks]
+
+    def handle_recognized_faces(self, recognized_faces):
+        self.scheduler.faces_seen(len(recognized_faces))
+        identified = self.track_cache.identified()
+        if identified is not None:
+            # Store the currently detected face
+            self.current_face = identified.name
 
         # Process the recognized faces (link balances, etc.)
         self.process_faces(recognized_faces)
 
-    def recognize_faces(self, frame):
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-
-        recognized_faces = []
-        for encoding in face_encodings:
-            matches = face_recognition.compare_faces([face["encoding"] for face in self.known_faces], encoding)
-            name = "Unknown"
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = self.known_faces[first_match_index]["name"]
-                # Store the currently detected face
-                self.current_face = name
-            recognized_faces.append(name)
-        return recognized_faces
-
     def process_faces(self, recognized_faces):
         # Placeholder for face processing logic
         for name in recognized_faces:
@@ -154,30 +168,23 @@ class POSApp(QMainWindow):
         frame = self.video_stream.read()
 
         # Find faces in the frame
-        face_locations = face_recognition.face_locations(frame)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_locations = self.detector.locate(rgb_frame)
 
         if face_locations:
             # Take the first face found
-            top, right, bottom, left = face_locations[0]
-
-            # Crop the face from the frame
-            face_image = frame[top:bottom, left:right]
-
-            # Generate a random 12-digit number starting with 42 as the filename
-            filename = f"42{''.join(random.choices(string.digits, k=10))}.jpg"
-
-            # Save the face image to the "faces" folder
-            face_path = os.path.join("faces", filename)
-            cv2.imwrite(face_path, cv2.cvtColor(face_image, cv2.COLOR_RGB2BGR))
+            encoding = face_recognition.face_encodings(rgb_frame, face_locations[:1])[0]
 
-            # Create a text file with the same name in the "balances" folder and set the default balance to zero
-            balance_filename = os.path.splitext(filename)[0] + "_balance.txt"
-            balance_path = os.path.join("balances", balance_filename)
-            with open(balance_path, 'w') as balance_file:
-                balance_file.write("0")
+            # Look the face up in the whole gallery before issuing a new ID, an approximate
+            # miss here would register the same person twice
+            duplicate = self.gallery.best_match([encoding], exact=True)
+            if duplicate is not None:
+                self.show_popup("Already Registered", f"This face is already registered as {duplicate.name}")
+            else:
+                filename = self.enroll_face(frame, rgb_frame, face_locations[0], encoding)
 
-            # Show a confirmation popup
-            self.show_popup("Success", f"Face registered: {filename}")
+                # Show a confirmation popup
+                self.show_popup("Success", f"Face registered: {filename}")
 
         else:
             # Show a failure popup
@@ -189,6 +196,35 @@ class POSApp(QMainWindow):
         self.add_money_button.setEnabled(True)
         self.inquiry_button.setEnabled(True)
 
+    def enroll_face(self, frame, rgb_frame, face_location, encoding):
+        # Generate a random 12-digit number starting with 42 as the filename, skipping IDs
+        # that are already taken
+        while True:
+            face_name = f"42{''.join(random.choices(string.digits, k=10))}"
+            if face_name not in self.gallery and not self.ledger.has_account(face_name):
+                break
+        filename = f"{face_name}.jpg"
+
+        # Save the cropped face image to the "faces" folder, frame is already BGR
+        top, right, bottom, left = face_location
+        face_path = os.path.join("faces", filename)
+        cv2.imwrite(face_path, frame[top:bottom, left:right])
+
+        # Store the encoding taken from the full frame next to the image, so loaders never
+        # have to find the face in the tight crop again
+        metadata = {"quality": face_quality(rgb_frame, face_location), "enrolled_at": time.time(),
+                    "enrolled_by": "bank"}
+        FaceEncodingCache("faces").merge([(dict(image_key(face_path), **metadata), encoding)])
+
+        # Open a ledger account for the new face with the default balance of zero
+        self.ledger.open_account(face_name)
+
+        # Make the new customer recognizable right away without reloading the gallery,
+        # and tell the other running editions about them through the gallery journal
+        self.gallery.add(face_name, encoding)
+        GalleryJournal().record_add(face_name, filename)
+        return filename
+
     def perform_transaction(self):
         self.handle_money_operation("Transaction", -1)
 
@@ -217,18 +253,26 @@ class POSApp(QMainWindow):
                     self.show_popup("Error", "Invalid expression. Please enter a valid numerical expression.")
                     return
 
-                # Update the face balance
-                self.face_balances[self.current_face] += sign * amount
+                # Update the face balance in the ledger, the buttons come back with the result
+                face_name = self.current_face
+                future = self.ledger_writer.adjust(face_name, sign * amount, operation_type)
+                self.ledger_results.deliver(future, lambda future: self.money_operation_done(
+                    future, operation_type, face_name, amount))
+                return
 
-                # Update the text file in the "balances" folder
-                balance_filename = self.current_face + "_balance.txt"
-                balance_path = os.path.join("balances", balance_filename)
-                with open(balance_path, 'w') as balance_file:
-                    balance_file.write(str(self.face_balances[self.current_face]))
+        # Re-enable buttons
+        self.register_button.setEnabled(True)
+        self.transaction_button.setEnabled(True)
+        self.add_money_button.setEnabled(True)
+        self.inquiry_button.setEnabled(True)
 
-                # Show a transaction completed popup
-                self.show_popup(f"{operation_type} Completed",
-                                f"{operation_type} completed for {self.current_face}: +{amount}")
+    def money_operation_done(self, future, operation_type, face_name, amount):
+        try:
+            future.result()
+            # Show a transaction completed popup
+            self.show_popup(f"{operation_type} Completed", f"{operation_type} completed for {face_name}: +{amount}")
+        except (LedgerError, ValueError) as e:
+            self.show_popup("Error", f"{operation_type} failed for {face_name}: {e}")
 
         # Re-enable buttons
         self.register_button.setEnabled(True)
@@ -239,7 +283,7 @@ class POSApp(QMainWindow):
     def inquire_balance(self):
         if self.current_face is not None:
             # Show the balance in a popup
-            balance = self.face_balances[self.current_face]
+            balance = self.ledger.balance(self.current_face)
             self.show_popup("Balance Inquiry", f"Balance for {self.current_face}: {balance}")
         else:
             # Show a message if no face is detected
@@ -252,13 +296,21 @@ class POSApp(QMainWindow):
         msg_box.exec_()
 
     def closeEvent(self, event):
-        # Release the video stream when closing the application
+        # Stop recognition and release the video stream when closing the application
+        self.scheduler.stop()
+        if self.gallery_watcher is not None:
+            self.gallery_watcher.stop()
+        self.recognition_worker.stop()
         self.video_stream.stop()
+        self.ledger_writer.stop()
         event.accept()
 
 
 if __name__ == "__main__":
+    metrics.start()
     app = QApplication(sys.argv)
     pos_app = POSApp()
     pos_app.show()
+    startup_timer.mark("bank: window shown")
+    startup_timer.report()
     sys.exit(app.exec_())
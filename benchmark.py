@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from face_cache import ENCODING_SIZE
+from metrics import summarize
+
+STAGES = ["capture", "process", "detect", "encode", "match", "render"]
+
+
+def synthetic_encodings(count, seed=0):
+    # Random unit directions scaled to the typical length of a dlib face encoding
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(count, ENCODING_SIZE)).astype(np.float32)
+    encodings *= 0.45 / np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings
+
+
+class SyntheticSource:
+    # Noise frames for when no recording is given; detection and encoding then only
+    # measure the cost of scanning an empty frame
+    def __init__(self, width=640, height=480, frames=30, seed=0):
+        rng = np.random.default_rng(seed)
+        self.frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(frames)]
+        self.position = 0
+
+    def start(self):
+        return self
+
+    def read(self):
+        frame = self.frames[self.position % len(self.frames)]
+        self.position += 1
+        return frame.copy()
+
+    def stop(self):
+        pass
+
+
+def offscreen_app():
+    # FramePipeline.preview builds QPixmaps, which need a QApplication even without a screen
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+class RecognitionBenchmark:
+    # Runs the live camera pipeline of the editions (capture, FramePipeline resize and colour
+    # conversion into a pooled buffer, detection with tracking, encoding of unverified
+    # tracks, gallery match and the FramePipeline preview) on a replayed source and records
+    # how long every stage takes per frame.
+    # One run is made for every combination of gallery size and frame width.
+    def __init__(self, source=None, frames=200, warmup=10, detect_every=3, scale=0.5, model="hog",
+                 render=True, index="ivf"):
+        self.source = source
+        self.frames = frames
+        self.warmup = warmup
+        self.detect_every = detect_every
+        self.scale = scale
+        self.model = model
+        self.render = render
+        self.index = index
+
+    def open_source(self):
+        if self.source is None:
+            return SyntheticSource()
+        from frame_source import open_frame_source
+        return open_frame_source(self.source, loop=True)
+
+    def run(self, gallery_sizes, widths):
+        results = []
+        for gallery_size in gallery_sizes:
+            for width in widths:
+                result = self.run_one(gallery_size, width)
+                results.append(result)
+                print_result(result)
+        return results
+
+    def run_one(self, gallery_size, width):
+        import face_recognition
+        from detection import FaceDetector
+        from face_index import make_index
+        from frame_buffers import FramePipeline
+        from gallery import FaceGallery
+        from track_cache import TrackIdentityCache
+
+        # Startup covers what an edition does before its first frame: building the
+        # gallery and its index, and opening the camera
+        started = time.perf_counter()
+        encodings = synthetic_encodings(gallery_size)
+        gallery = FaceGallery([f"synthetic{i}" for i in range(gallery_size)], encodings, index=make_index(self.index))
+        gallery_seconds = time.perf_counter() - started
+        source = self.open_source()
+        startup_seconds = time.perf_counter() - started
+        detector = FaceDetector(scale=self.scale, detect_every=self.detect_every, model=self.model)
+        track_cache = TrackIdentityCache(tolerance=gallery.tolerance)
+        frame_pipeline = FramePipeline(width=width)
+        app = offscreen_app() if self.render else None
+
+        # Noise frames have no faces, probe the gallery with a synthetic query instead so
+        # its size still shows up in the match stage
+        probes = synthetic_encodings(1, seed=1) if self.source is None else None
+
+        timings = {stage: [] for stage in STAGES + ["total"]}
+        faces = 0
+        run_started = None
+        try:
+            for frame_number in range(self.warmup + self.frames):
+                if frame_number == self.warmup:
+                    run_started = time.perf_counter()
+                stage_times = {}
+
+                began = time.perf_counter()
+                frame = source.read()
+                stage_times["capture"] = time.perf_counter() - began
+                if frame is None:
+                    break
+
+                began = time.perf_counter()
+                rgb_frame = frame_pipeline.process(frame)
+                stage_times["process"] = time.perf_counter() - began
+
+                began = time.perf_counter()
+                tracks = track_cache.update(detector.detect(rgb_frame))
+                stage_times["detect"] = time.perf_counter() - began
+
+                began = time.perf_counter()
+                stale_tracks = [track for track in tracks if track_cache.needs_verification(track)]
+                face_encodings = []
+                if stale_tracks:
+                    face_encodings = face_recognition.face_encodings(rgb_frame, [track.box for track in stale_tracks])
+                stage_times["encode"] = time.perf_counter() - began
+
+                began = time.perf_counter()
+                if face_encodings:
+                    for track, match in zip(stale_tracks, gallery.match(face_encodings)):
+                        track_cache.verify(track, match)
+                elif probes is not None:
+                    gallery.match(probes)
+                stage_times["match"] = time.perf_counter() - began
+
+                if app is not None:
+                    began = time.perf_counter()
+                    frame_pipeline.preview(rgb_frame)
+                    stage_times["render"] = time.perf_counter() - began
+
+                # Hand the buffer back like the editions' recognition worker does, so the
+                # pool is reused instead of growing by a frame every tick
+                frame_pipeline.release(rgb_frame)
+
+                if frame_number >= self.warmup:
+                    faces += len(tracks)
+                    for stage, seconds in stage_times.items():
+                        timings[stage].append(seconds)
+                    timings["total"].append(sum(stage_times.values()))
+        finally:
+            source.stop()
+
+        measured = len(timings["total"])
+        elapsed = time.perf_counter() - run_started if run_started is not None else 0.0
+        return {"gallery_size": gallery_size, "width": width, "frames": measured, "faces": faces,
+                "gallery_seconds": gallery_seconds, "startup_seconds": startup_seconds,
+                "fps": measured / elapsed if elapsed else 0.0,
+                "stages": {stage: summarize(samples) for stage, samples in timings.items()}}
+
+
+def print_result(result):
+    print(f"\ngallery {result['gallery_size']}, width {result['width']}: {result['frames']} frames, "
+          f"{result['faces']} faces, startup {result['startup_seconds']:.3f}s "
+          f"(gallery {result['gallery_seconds']:.3f}s), {result['fps']:.1f} fps")
+    print(f"{'stage':<10} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'max ms':>9}")
+    for stage, summary in result["stages"].items():
+        if not summary["count"]:
+            continue
+        print(f"{stage:<10} {summary['p50']:>9.2f} {summary['p99']:>9.2f} {summary['mean']:>9.2f} {summary['max']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure FacePOS recognition latency on a replayed camera source")
+    parser.add_argument("--source", default=None, help="video file or image folder to replay; "
+                                                       "synthetic noise frames when omitted")
+    parser.add_argument("--gallery-sizes", default="1000,10000,100000")
+    parser.add_argument("--widths", default="640,800,1280", help="frame widths after the process stage")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--detect-every", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=0.5)
+    parser.add_argument("--model", default="hog")
+    parser.add_argument("--index", choices=["ivf", "exact"], default="ivf")
+    parser.add_argument("--no-render", action="store_true", help="skip the Qt preview stage")
+    parser.add_argument("--output", help="also write the results as JSON, e.g. to compare releases")
+    args = parser.parse_args()
+
+    benchmark = RecognitionBenchmark(args.source, args.frames, args.warmup, args.detect_every, args.scale,
+                                     args.model, not args.no_render, args.index)
+    results = benchmark.run([int(size) for size in args.gallery_sizes.split(",")],
+                            [int(width) for width in args.widths.split(",")])
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
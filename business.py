@@ -1,12 +1,20 @@
 import sys
 import cv2
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton, QMessageBox, QInputDialog, QComboBox
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QImage, QPixmap
-from imutils.video import VideoStream
-import imutils
-import os
-import face_recognition
+from PyQt5.QtCore import Qt
+from accounts import BusinessDirectory
+from detection import FaceDetector
+from frame_buffers import FramePipeline
+from frame_scheduler import FrameScheduler
+from ledger import InsufficientFunds, Ledger, LedgerError, UnknownAccount, business_account
+from ledger_writer import LedgerResults, LedgerWriter
+from metrics import metrics
+from recipient_picker import RecipientPicker
+from recognition import FaceRecognizer
+from recognition_daemon import open_gallery, open_video_stream
+from recognition_worker import RecognitionWorker
+from startup import startup_timer
+from track_cache import TrackIdentityCache
 
 
 class BusinessPOSApp(QMainWindow):
@@ -38,31 +46,43 @@ class BusinessPOSApp(QMainWindow):
         self.balance_label = QLabel(self)
         self.layout.addWidget(self.balance_label, alignment=Qt.AlignCenter)
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_camera)
-        self.timer.start(100)  # Update every 100 milliseconds
-
         self.business_name = None
         self.business_balance = 0.0
 
-        self.known_faces = self.load_known_faces("faces")
-
-        self.video_stream = VideoStream(src=0).start()
+        self.ledger = Ledger()
+        startup_timer.mark("business: ledger opened")
+        self.business_directory = BusinessDirectory(self.ledger)
+        # Postings are committed in groups on a writer thread, results come back as signals
+        self.ledger_writer = LedgerWriter()
+        self.ledger_writer.start()
+        self.ledger_results = LedgerResults(self)
+        # The gallery is served by the recognition daemon when one is running
+        self.gallery, self.gallery_watcher = open_gallery("faces")
+        startup_timer.mark("business: gallery loaded")
+
+        # Face detection settings for this terminal
+        self.detector = FaceDetector(scale=0.5, detect_every=5, model="hog", upsample=1)
+
+        # Customers in front of the camera are tracked in the background so a transaction
+        # can use the cached identity instead of running recognition on the click
+        self.track_cache = TrackIdentityCache(tolerance=self.gallery.tolerance)
+        self.recognizer = FaceRecognizer(self.gallery, self.detector, self.track_cache)
+        self.frame_pipeline = FramePipeline(width=800)
+        self.recognition_worker = RecognitionWorker(self.recognizer.recognize, self, self.frame_pipeline.release)
+        self.recognition_worker.faces_recognized.connect(lambda tracks: self.scheduler.faces_seen(len(tracks)))
+        self.recognition_worker.start()
+
+        # Update the camera feed every 100 milliseconds at best, backing off under load and
+        # idling while nobody is at the till
+        self.scheduler = FrameScheduler(self.update_camera, self, preview_interval=100,
+                                        recognition_interval=100, worker=self.recognition_worker)
+
+        self.video_stream = open_video_stream()
+        startup_timer.mark("business: camera started")
+        self.scheduler.start()
 
         self.login_business()
 
-    def load_known_faces(self, faces_folder):
-        known_faces = []
-
-        for filename in os.listdir(faces_folder):
-            if filename.endswith(".jpg") or filename.endswith(".png"):
-                face_name = os.path.splitext(filename)[0]
-                face_image = face_recognition.load_image_file(os.path.join(faces_folder, filename))
-                face_encoding = face_recognition.face_encodings(face_image)[0]
-                known_faces.append({"encoding": face_encoding, "name": face_name})
-
-        return known_faces
-
     def login_business(self):
         while True:
             username, ok = QInputDialog.getText(self, "Login Business", "Enter username:")
@@ -73,121 +93,114 @@ class BusinessPOSApp(QMainWindow):
             if not ok:
                 sys.exit()
 
-            business_files = [f for f in os.listdir("business") if f.endswith(".txt")]
-            for business_file in business_files:
-                with open(os.path.join("business", business_file), "r") as file:
-                    data = file.read().splitlines()
-                    if username == data[1] and password == data[2]:
-                        self.business_name = data[0]
-                        self.business_name_label.setText(f"Business: {self.business_name}")
-                        self.business_balance = float(data[3])
-                        self.update_balance_label()
-                        return
+            business_name = self.business_directory.authenticate(username, password)
+            if business_name is not None:
+                self.business_name = business_name
+                self.business_name_label.setText(f"Business: {self.business_name}")
+                self.business_balance = self.ledger.balance(business_account(self.business_name))
+                self.update_balance_label()
+                return
 
             QMessageBox.warning(self, "Error", "Invalid credentials. Please try again.")
 
     def update_camera(self):
-        frame = self.video_stream.read()
-        frame = imutils.resize(frame, width=800)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with metrics.span("update_camera"):
+            frame = self.video_stream.read()
+            rgb_frame = self.frame_pipeline.process(frame)
 
-        self.camera_label.setPixmap(QPixmap.fromImage(QImage(rgb_frame.data, rgb_frame.shape[1], rgb_frame.shape[0], QImage.Format_RGB888)))
+            self.camera_label.setPixmap(self.frame_pipeline.preview(rgb_frame))
+            if self.scheduler.should_recognize(rgb_frame):
+                self.recognition_worker.submit(rgb_frame)
+            else:
+                self.frame_pipeline.release(rgb_frame)
+        metrics.count("frames_processed")
 
     def perform_transaction(self):
         if not self.business_name:
             QMessageBox.warning(self, "Error", "Please log in to your business.")
             return
 
-        match_found = False
-        frame = self.video_stream.read()
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_frame)
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        # Only the identification is timed, the rest of the method waits for the cashier
+        with metrics.span("transaction_identify"):
+            customer = self.track_cache.identified()
+            if customer is None:
+                # Nobody identified in the background yet, recognize the current frame directly
+                frame = self.video_stream.read()
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                customer = self.recognizer.identify(rgb_frame)
 
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces([face["encoding"] for face in self.known_faces], face_encoding)
-            if True in matches:
-                match_found = True
-                break
-
-        if not match_found:
+        if customer is None:
             QMessageBox.warning(self, "Error", "The person on the camera is not registered. Transaction cannot be performed.")
             return
 
-        customer_name = None
-        for face in self.known_faces:
-            if face_recognition.compare_faces([face["encoding"]], face_encoding)[0]:
-                customer_name = face["name"]
-                break
-
-        customer_balance = 0.0
-        with open(os.path.join("balances", f"{customer_name}_balance.txt"), "r") as file:
-            customer_balance = float(file.readline().strip())
+        customer_name = customer.name
 
-        transaction_amount, ok = QInputDialog.getDouble(self, "Transaction", "Enter amount to subtract from customer:")
+        transaction_amount, ok = QInputDialog.getDouble(self, "Transaction", "Enter amount to subtract from customer:",
+                                                        min=0.01, decimals=2)
         if ok:
-            if customer_balance >= transaction_amount:
-                customer_balance -= transaction_amount
-                self.business_balance += transaction_amount
-                self.update_balance_label()
-
-                with open(os.path.join("balances", f"{customer_name}_balance.txt"), "w") as file:
-                    file.write(f"{customer_balance:.2f}")
-
-                with open(os.path.join("business", f"{self.business_name}.txt"), "r+") as file:
-                    lines = file.readlines()
-                    lines[3] = f"{self.business_balance:.2f}\n"
-                    file.seek(0)
-                    file.writelines(lines)
-            else:
-                QMessageBox.warning(self, "Insufficient Funds", "The customer has insufficient funds for this transaction.")
+            # Debit the customer and credit the business in one ledger transaction
+            future = self.ledger_writer.transfer(customer_name, business_account(self.business_name),
+                                                 transaction_amount, "purchase")
+            self.ledger_results.deliver(future, self.transaction_done)
+
+    def transaction_done(self, future):
+        try:
+            self.business_balance = future.result()[business_account(self.business_name)]
+            self.update_balance_label()
+        except InsufficientFunds:
+            QMessageBox.warning(self, "Insufficient Funds", "The customer has insufficient funds for this transaction.")
+        except UnknownAccount:
+            QMessageBox.warning(self, "Error", "The customer has no account. Please contact the bank.")
+        except (LedgerError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"The transaction failed: {e}")
 
     def transfer_money(self):
         if not self.business_name:
             QMessageBox.warning(self, "Error", "Please log in to your business.")
             return
 
-        transfer_amount, ok = QInputDialog.getDouble(self, "Transfer Money", "Enter amount to transfer:")
+        transfer_amount, ok = QInputDialog.getDouble(self, "Transfer Money", "Enter amount to transfer:",
+                                                     min=0.01, decimals=2)
         if not ok:
             return
 
-        transfer_recipient_names = [face["name"] for face in self.known_faces]
-        recipient, ok = QInputDialog.getItem(self, "Transfer Money", "Select recipient:", transfer_recipient_names, 0, False)
+        recipient, ok = RecipientPicker.get_recipient(self, self.gallery, "Transfer Money")
         if not ok:
             return
 
-        recipient_balance = 0.0
-        with open(os.path.join("balances", f"{recipient}_balance.txt"), "r") as file:
-            recipient_balance = float(file.readline().strip())
+        future = self.ledger_writer.transfer(business_account(self.business_name), recipient, transfer_amount)
+        self.ledger_results.deliver(future, lambda future: self.transfer_done(future, recipient, transfer_amount))
 
-        if self.business_balance >= transfer_amount:
-            self.business_balance -= transfer_amount
-            recipient_balance += transfer_amount
+    def transfer_done(self, future, recipient, transfer_amount):
+        try:
+            self.business_balance = future.result()[business_account(self.business_name)]
             self.update_balance_label()
-
-            with open(os.path.join("balances", f"{recipient}_balance.txt"), "w") as file:
-                file.write(f"{recipient_balance:.2f}")
-
-            with open(os.path.join("business", f"{self.business_name}.txt"), "r+") as file:
-                lines = file.readlines()
-                lines[3] = f"{self.business_balance:.2f}\n"
-                file.seek(0)
-                file.writelines(lines)
-
             QMessageBox.information(self, "Transfer Money", f"${transfer_amount:.2f} transferred to {recipient}.")
-        else:
+        except InsufficientFunds:
             QMessageBox.warning(self, "Insufficient Funds", "You have insufficient funds for this transfer.")
+        except UnknownAccount:
+            QMessageBox.warning(self, "Error", f"{recipient} has no account. Please contact the bank.")
+        except (LedgerError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"The transfer failed: {e}")
 
     def update_balance_label(self):
         self.balance_label.setText(f"Balance: ${self.business_balance:.2f}")
 
     def closeEvent(self, event):
+        if self.gallery_watcher is not None:
+            self.gallery_watcher.stop()
+        self.scheduler.stop()
+        self.recognition_worker.stop()
         self.video_stream.stop()
+        self.ledger_writer.stop()
         event.accept()
 
 
 if __name__ == "__main__":
+    metrics.start()
     app = QApplication(sys.argv)
     pos_app = BusinessPOSApp()
     pos_app.show()
+    startup_timer.mark("business: window shown")
+    startup_timer.report()
     sys.exit(app.exec_())
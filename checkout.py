@@ -0,0 +1,154 @@
+import argparse
+import sys
+from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QGridLayout, QWidget, QPushButton, QMessageBox, QInputDialog, QLineEdit
+from PyQt5.QtCore import Qt
+from accounts import BusinessDirectory
+from frame_scheduler import FrameScheduler
+from frame_source import open_frame_source
+from lanes import Lane, LaneRecognitionWorker
+from ledger import InsufficientFunds, Ledger, LedgerError, UnknownAccount, business_account
+from ledger_writer import LedgerResults, LedgerWriter
+from metrics import metrics
+from recognition_daemon import open_gallery
+from startup import startup_timer
+
+
+class CheckoutWindow(QMainWindow):
+    # A supermarket front in one process: every lane has its own camera, preview and
+    # customer, while the gallery, the recognition worker and the ledger writer are shared
+    # by all of them
+    def __init__(self, sources, columns=3):
+        super().__init__()
+
+        self.setWindowTitle("FacePOS Checkout")
+        self.setGeometry(100, 100, 1280, 800)
+
+        self.central_widget = QWidget()
+        self.setCentralWidget(self.central_widget)
+
+        self.layout = QGridLayout(self.central_widget)
+
+        self.business_name = None
+        self.ledger = Ledger()
+        self.business_directory = BusinessDirectory(self.ledger)
+        # Charges from all lanes are committed in groups on one writer thread
+        self.ledger_writer = LedgerWriter()
+        self.ledger_writer.start()
+        self.ledger_results = LedgerResults(self)
+        startup_timer.mark("checkout: ledger opened")
+
+        self.gallery, self.gallery_watcher = open_gallery("faces")
+        startup_timer.mark("checkout: gallery loaded")
+
+        self.lanes = []
+        self.camera_labels = []
+        self.customer_labels = []
+        for lane_id, source in enumerate(sources):
+            lane = Lane(lane_id, open_frame_source(source), self.gallery.tolerance)
+            self.lanes.append(lane)
+
+            lane_widget = QWidget(self)
+            lane_layout = QGridLayout(lane_widget)
+            camera_label = QLabel(self)
+            lane_layout.addWidget(camera_label, 0, 0, alignment=Qt.AlignCenter)
+            customer_label = QLabel(f"Lane {lane_id + 1}: no customer", self)
+            lane_layout.addWidget(customer_label, 1, 0, alignment=Qt.AlignCenter)
+            charge_button = QPushButton(f"Charge lane {lane_id + 1}", self)
+            charge_button.clicked.connect(lambda checked, lane=lane: self.perform_transaction(lane))
+            lane_layout.addWidget(charge_button, 2, 0, alignment=Qt.AlignCenter)
+
+            self.layout.addWidget(lane_widget, lane_id // columns, lane_id % columns)
+            self.camera_labels.append(camera_label)
+            self.customer_labels.append(customer_label)
+        startup_timer.mark("checkout: cameras started")
+
+        self.recognition_worker = LaneRecognitionWorker(self.gallery, self.lanes, self)
+        self.recognition_worker.lane_recognized.connect(self.handle_lane_recognized)
+        self.recognition_worker.start()
+
+        # One adaptive tick refreshes every lane
+        self.scheduler = FrameScheduler(self.update_cameras, self, preview_interval=66)
+
+        self.login_business()
+        self.scheduler.start()
+
+    def login_business(self):
+        while True:
+            username, ok = QInputDialog.getText(self, "Login Business", "Enter username:")
+            if not ok:
+                sys.exit()
+
+            password, ok = QInputDialog.getText(self, "Login Business", "Enter password:", QLineEdit.Password)
+            if not ok:
+                sys.exit()
+
+            business_name = self.business_directory.authenticate(username, password)
+            if business_name is not None:
+                self.business_name = business_name
+                self.setWindowTitle(f"FacePOS Checkout - {business_name}")
+                return
+
+            QMessageBox.warning(self, "Error", "Invalid credentials. Please try again.")
+
+    def update_cameras(self):
+        with metrics.span("update_cameras"):
+            for lane, camera_label in zip(self.lanes, self.camera_labels):
+                rgb_frame = lane.read()
+                if rgb_frame is None:
+                    continue
+                camera_label.setPixmap(lane.frame_pipeline.preview(rgb_frame))
+                self.recognition_worker.submit(lane, rgb_frame)
+        metrics.count("frames_processed", len(self.lanes))
+
+    def handle_lane_recognized(self, lane_id, customer_name):
+        text = f"Lane {lane_id + 1}: {customer_name}" if customer_name else f"Lane {lane_id + 1}: no customer"
+        self.customer_labels[lane_id].setText(text)
+
+    def perform_transaction(self, lane):
+        customer_name = lane.current_face
+        if customer_name is None:
+            QMessageBox.warning(self, "Error", f"No registered customer at lane {lane.lane_id + 1}.")
+            return
+
+        amount, ok = QInputDialog.getDouble(self, f"Lane {lane.lane_id + 1}", f"Amount to charge {customer_name}:",
+                                            min=0.01, decimals=2)
+        if not ok:
+            return
+        future = self.ledger_writer.transfer(customer_name, business_account(self.business_name), amount, "purchase")
+        self.ledger_results.deliver(future, lambda future: self.transaction_done(future, lane, customer_name, amount))
+
+    def transaction_done(self, future, lane, customer_name, amount):
+        try:
+            future.result()
+            QMessageBox.information(self, f"Lane {lane.lane_id + 1}", f"${amount:.2f} charged to {customer_name}.")
+        except InsufficientFunds:
+            QMessageBox.warning(self, "Insufficient Funds", "The customer has insufficient funds for this transaction.")
+        except UnknownAccount:
+            QMessageBox.warning(self, "Error", "The customer has no account. Please contact the bank.")
+        except (LedgerError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"The charge at lane {lane.lane_id + 1} failed: {e}")
+
+    def closeEvent(self, event):
+        self.scheduler.stop()
+        if self.gallery_watcher is not None:
+            self.gallery_watcher.stop()
+        self.recognition_worker.stop()
+        for lane in self.lanes:
+            lane.video_stream.stop()
+        self.ledger_writer.stop()
+        event.accept()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several FacePOS checkout lanes in one process")
+    parser.add_argument("sources", nargs="+", help="one camera index, video file or image folder per lane")
+    parser.add_argument("--columns", type=int, default=3)
+    args = parser.parse_args()
+
+    metrics.start()
+    app = QApplication(sys.argv[:1])
+    checkout_window = CheckoutWindow(args.sources, args.columns)
+    checkout_window.show()
+    startup_timer.mark("checkout: window shown")
+    startup_timer.report()
+    sys.exit(app.exec_())
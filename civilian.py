@@ -1,12 +1,19 @@
 import sys
 import cv2
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QMessageBox, QPushButton, QInputDialog, QLineEdit
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QImage, QPixmap
-from imutils.video import VideoStream
-import imutils
+from PyQt5.QtCore import Qt
 import os
 import face_recognition
+from detection import FaceDetector
+from frame_buffers import FramePipeline
+from frame_scheduler import FrameScheduler
+from gallery_journal import GalleryJournal
+from ledger import InsufficientFunds, Ledger, LedgerError, UnknownAccount
+from ledger_writer import LedgerResults, LedgerWriter
+from metrics import metrics
+from recipient_picker import RecipientPicker
+from recognition_daemon import open_gallery, open_video_stream
+from startup import startup_timer
 
 
 class CivilianPOSApp(QMainWindow):
@@ -38,121 +45,126 @@ class CivilianPOSApp(QMainWindow):
         self.deregister_button.clicked.connect(self.deregister)
         self.layout.addWidget(self.deregister_button, alignment=Qt.AlignCenter)
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_camera)
-        self.timer.start(100)  
-
         self.civilian_name = None
         self.civilian_balance = 0.0
 
-        self.known_faces = self.load_known_faces("faces")
-
-        self.video_stream = VideoStream(src=0).start()
+        self.ledger = Ledger()
+        startup_timer.mark("civilian: ledger opened")
+        # Transfers are committed in groups on a writer thread, results come back as signals
+        self.ledger_writer = LedgerWriter()
+        self.ledger_writer.start()
+        self.ledger_results = LedgerResults(self)
+        # The gallery is served by the recognition daemon when one is running
+        self.gallery, self.gallery_watcher = open_gallery("faces")
+        startup_timer.mark("civilian: gallery loaded")
+
+        # Face detection settings for this terminal
+        self.detector = FaceDetector(scale=0.5, model="hog", upsample=1)
+        self.frame_pipeline = FramePipeline(width=800)
+        # The preview only needs to keep up while someone is moving in front of it
+        self.scheduler = FrameScheduler(self.update_camera, self, preview_interval=100)
+
+        self.video_stream = open_video_stream()
+        startup_timer.mark("civilian: camera started")
+        self.scheduler.start()
 
         self.login_civilian()
 
-    def load_known_faces(self, faces_folder):
-        known_faces = []
-
-        for filename in os.listdir(faces_folder):
-            if filename.endswith(".jpg") or filename.endswith(".png"):
-                civilian_name = os.path.splitext(filename)[0]
-                face_image = face_recognition.load_image_file(os.path.join(faces_folder, filename))
-                face_encoding = face_recognition.face_encodings(face_image)[0]
-                known_faces.append({"encoding": face_encoding, "name": civilian_name})
-
-        return known_faces
-
     def login_civilian(self):
-        match_found = False
-        while not match_found:
-            frame = self.video_stream.read()
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_frame)
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        while True:
+            with metrics.span("login_civilian"):
+                frame = self.video_stream.read()
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face_locations = self.detector.locate(rgb_frame)
+                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                match = self.gallery.best_match(face_encodings) if face_encodings else None
 
             if not face_encodings:
                 self.show_register_popup()
                 sys.exit()
 
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces([face["encoding"] for face in self.known_faces], face_encoding)
-                if True in matches:
-                    match_found = True
-                    break
-
-            if match_found:
-                self.civilian_name = [face["name"] for face in self.known_faces if face_recognition.compare_faces([face["encoding"]], face_encoding)][0]
+            if match is not None:
+                self.civilian_name = match.name
                 self.business_name_label.setText(f"Civilian: {self.civilian_name}")
                 self.load_civilian_balance()
                 break
 
     def load_civilian_balance(self):
-        balance_file = os.path.join("./balances", f"{self.civilian_name}_balance.txt")
-        if os.path.exists(balance_file):
-            with open(balance_file, "r") as file:
-                self.civilian_balance = float(file.read().strip())
-                self.balance_label.setText(f"Balance: ${self.civilian_balance:.2f}")
-        else:
+        try:
+            self.civilian_balance = self.ledger.balance(self.civilian_name)
+            self.balance_label.setText(f"Balance: ${self.civilian_balance:.2f}")
+        except UnknownAccount:
             self.balance_label.setText("Balance: $0.00")
-            QMessageBox.warning(self, "Error", "Balance file not found. Please contact support.")
+            QMessageBox.warning(self, "Error", "Balance account not found. Please contact support.")
 
     def update_camera(self):
-        frame = self.video_stream.read()
-        frame = imutils.resize(frame, width=800)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with metrics.span("update_camera"):
+            frame = self.video_stream.read()
+            rgb_frame = self.frame_pipeline.process(frame)
 
-        self.camera_label.setPixmap(QPixmap.fromImage(QImage(rgb_frame.data, rgb_frame.shape[1], rgb_frame.shape[0], QImage.Format_RGB888)))
+            self.camera_label.setPixmap(self.frame_pipeline.preview(rgb_frame))
+            self.scheduler.observe(rgb_frame)
+            # The civilian edition only previews, the buffer can be reused right away
+            self.frame_pipeline.release(rgb_frame)
+        metrics.count("frames_processed")
 
     def transfer_money(self):
-        recipient, ok = QInputDialog.getItem(self, "Transfer Money", "Select recipient:", [face["name"] for face in self.known_faces])
+        recipient, ok = RecipientPicker.get_recipient(self, self.gallery, "Transfer Money")
         if ok:
-            amount, ok = QInputDialog.getDouble(self, "Transfer Money", "Enter amount to transfer:")
+            amount, ok = QInputDialog.getDouble(self, "Transfer Money", "Enter amount to transfer:",
+                                                min=0.01, decimals=2)
             if ok:
-                if amount > self.civilian_balance:
-                    QMessageBox.warning(self, "Insufficient Funds", "You don't have enough funds for this transfer.")
-                else:
-                    self.civilian_balance -= amount
-                    self.balance_label.setText(f"Balance: ${self.civilian_balance:.2f}")
-                    self.update_civilian_balance_file()
-                    recipient_balance_file = os.path.join("balances", f"{recipient}_balance.txt")
-                    if os.path.exists(recipient_balance_file):
-                        with open(recipient_balance_file, "r+") as file:
-                            recipient_balance = float(file.read().strip())
-                            recipient_balance += amount
-                            file.seek(0)
-                            file.write(f"{recipient_balance:.2f}")
-                    QMessageBox.information(self, "Transfer Successful", f"${amount:.2f} transferred to {recipient}.")
+                future = self.ledger_writer.transfer(self.civilian_name, recipient, amount)
+                self.ledger_results.deliver(future, lambda future: self.transfer_done(future, recipient, amount))
+
+    def transfer_done(self, future, recipient, amount):
+        try:
+            self.civilian_balance = future.result()[self.civilian_name]
+            self.balance_label.setText(f"Balance: ${self.civilian_balance:.2f}")
+            QMessageBox.information(self, "Transfer Successful", f"${amount:.2f} transferred to {recipient}.")
+        except InsufficientFunds:
+            QMessageBox.warning(self, "Insufficient Funds", "You don't have enough funds for this transfer.")
+        except UnknownAccount:
+            QMessageBox.warning(self, "Error", f"{recipient} has no account. Please contact support.")
+        except (LedgerError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"The transfer failed: {e}")
 
     def deregister(self):
-        if self.civilian_balance == 0.0:
-            face_file = os.path.join("faces", f"{self.civilian_name}.jpg")
-            balance_file = os.path.join("balances", f"{self.civilian_name}_balance.txt")
-            if os.path.exists(face_file):
-                os.remove(face_file)
-            if os.path.exists(balance_file):
-                os.remove(balance_file)
-            QMessageBox.information(self, "Deregistration Successful", "You have been deregistered successfully.")
-            sys.exit()
-        else:
+        try:
+            # Closing the account checks the balance inside the same ledger transaction
+            self.ledger.close_account(self.civilian_name)
+        except UnknownAccount:
+            pass
+        except LedgerError:
             QMessageBox.warning(self, "Error", "You cannot deregister while you still have funds in your account.")
-
-    def update_civilian_balance_file(self):
-        balance_file = os.path.join("balances", f"{self.civilian_name}_balance.txt")
-        with open(balance_file, "w") as file:
-            file.write(f"{self.civilian_balance:.2f}")
+            return
+
+        face_file = os.path.join("faces", f"{self.civilian_name}.jpg")
+        if os.path.exists(face_file):
+            os.remove(face_file)
+        self.gallery.remove(self.civilian_name)
+        GalleryJournal().record_remove(self.civilian_name)
+        QMessageBox.information(self, "Deregistration Successful", "You have been deregistered successfully.")
+        sys.exit()
 
     def show_register_popup(self):
         QMessageBox.warning(self, "Unregistered User", "To use the service, you must register with the bank.")
         sys.exit()
 
     def closeEvent(self, event):
+        if self.gallery_watcher is not None:
+            self.gallery_watcher.stop()
+        self.scheduler.stop()
         self.video_stream.stop()
+        self.ledger_writer.stop()
         event.accept()
 
 
 if __name__ == "__main__":
+    metrics.start()
     app = QApplication(sys.argv)
     pos_app = CivilianPOSApp()
     pos_app.show()
+    startup_timer.mark("civilian: window shown")
+    startup_timer.report()
     sys.exit(app.exec_())
@@ -0,0 +1,103 @@
+import cv2
+import face_recognition
+
+
+def scale_box(box, factor, frame_shape):
+    # Map a (top, right, bottom, left) box by factor and clip it to the frame
+    height, width = frame_shape[:2]
+    top, right, bottom, left = (int(round(value * factor)) for value in box)
+    return max(top, 0), min(right, width), min(bottom, height), max(left, 0)
+
+
+class BoxTracker:
+    # Cheap tracker used between detections: every box keeps a grayscale template of the
+    # face and is moved to the best template match inside a window around its last
+    # position. Tracks whose match score drops below min_score are dropped.
+    def __init__(self, search_margin=0.5, min_score=0.5):
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.tracks = []
+
+    def reset(self, gray_frame, boxes):
+        self.tracks = []
+        for top, right, bottom, left in boxes:
+            template = gray_frame[top:bottom, left:right]
+            if template.size:
+                self.tracks.append(((top, right, bottom, left), template.copy()))
+
+    def update(self, gray_frame):
+        # Returns the tracked boxes and whether any track was lost
+        height, width = gray_frame.shape[:2]
+        tracks = []
+        for (top, right, bottom, left), template in self.tracks:
+            margin_y = int((bottom - top) * self.search_margin)
+            margin_x = int((right - left) * self.search_margin)
+            window_top, window_left = max(top - margin_y, 0), max(left - margin_x, 0)
+            window = gray_frame[window_top:min(bottom + margin_y, height), window_left:min(right + margin_x, width)]
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                continue
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (x, y) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                continue
+            top, left = window_top + y, window_left + x
+            tracks.append(((top, left + template.shape[1], top + template.shape[0], left), template))
+
+        lost = len(tracks) < len(self.tracks)
+        self.tracks = tracks
+        return [box for box, _ in tracks], lost
+
+
+class FaceDetector:
+    # Detection pipeline for one terminal. Faces are detected on a copy of the frame
+    # downscaled by scale, and only every detect_every frames; in between the boxes are
+    # followed by a BoxTracker. A lost track triggers a fresh detection on the next frame.
+    # model and upsample are passed straight to face_recognition.face_locations.
+    def __init__(self, scale=0.5, detect_every=5, model="hog", upsample=1):
+        self.scale = scale
+        self.detect_every = max(1, detect_every)
+        self.model = model
+        self.upsample = upsample
+        self.tracker = BoxTracker()
+        self.frames_since_detection = self.detect_every
+
+    def downscale(self, rgb_frame):
+        if self.scale == 1:
+            return rgb_frame
+        return cv2.resize(rgb_frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def locate_small(self, small_frame):
+        return face_recognition.face_locations(small_frame, number_of_times_to_upsample=self.upsample,
+                                               model=self.model)
+
+    def locate(self, rgb_frame):
+        # One-shot detection that leaves the tracker alone, for enrollment and logins
+        boxes = self.locate_small(self.downscale(rgb_frame))
+        return [scale_box(box, 1 / self.scale, rgb_frame.shape) for box in boxes]
+
+    def detect(self, rgb_frame, force=False):
+        # Returns face boxes in full-frame (top, right, bottom, left) coordinates
+        small_frame = self.downscale(rgb_frame)
+        gray_frame = cv2.cvtColor(small_frame, cv2.COLOR_RGB2GRAY)
+
+        if force or self.frames_since_detection >= self.detect_every:
+            boxes = self.locate_small(small_frame)
+            self.tracker.reset(gray_frame, boxes)
+            self.frames_since_detection = 1
+        else:
+            boxes, lost = self.tracker.update(gray_frame)
+            self.frames_since_detection += 1
+            if lost:
+                self.frames_since_detection = self.detect_every
+
+        return [scale_box(box, 1 / self.scale, rgb_frame.shape) for box in boxes]
+
+
+def face_quality(rgb_frame, box):
+    # Size and sharpness (variance of the Laplacian) of a detected face, stored with the
+    # encoding at enrollment so blurry or tiny reference photos can be found later
+    top, right, bottom, left = box
+    gray_face = cv2.cvtColor(rgb_frame[top:bottom, left:right], cv2.COLOR_RGB2GRAY)
+    sharpness = cv2.Laplacian(gray_face, cv2.CV_64F).var() if gray_face.size else 0.0
+    return {"width": right - left, "height": bottom - top, "sharpness": round(float(sharpness), 1)}
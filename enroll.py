@@ -0,0 +1,155 @@
+import argparse
+import filecmp
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from face_cache import IMAGE_EXTENSIONS, FaceEncodingCache, encode_image_file, image_key
+from gallery_journal import GalleryJournal
+from ledger import Ledger
+
+CHECKPOINT_PATH = "enroll_checkpoint.jsonl"
+REPORT_PATH = "enroll_report.txt"
+
+
+def encode_job(job):
+    # Runs in a pool worker: decode and encode one image
+    source_path, filename = job
+    try:
+        return source_path, filename, encode_image_file(source_path), None
+    except Exception as e:
+        return source_path, filename, None, str(e)
+
+
+class BulkEnrollment:
+    # Headless bulk enrollment. Images are decoded and encoded across a process pool and
+    # committed in batches: each batch is copied into the faces folder, merged into the
+    # shared encoding cache, given ledger accounts and announced on the gallery journal.
+    # Every committed source image is appended to a checkpoint file so an interrupted run
+    # can be resumed.
+    def __init__(self, faces_folder="faces", checkpoint_path=CHECKPOINT_PATH, report_path=REPORT_PATH,
+                 workers=None, batch_size=500):
+        self.faces_folder = faces_folder
+        self.checkpoint_path = checkpoint_path
+        self.report_path = report_path
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.cache = FaceEncodingCache(faces_folder)
+        self.journal = GalleryJournal()
+        self.counts = {"enrolled": 0, "no_face": 0, "error": 0, "exists": 0}
+
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, "r") as file:
+            return {json.loads(line)["source"] for line in file if line.strip()}
+
+    def jobs(self, source_folder=None):
+        # Without a source folder, re-encode whatever in the faces folder isn't cached yet
+        done = self.read_checkpoint()
+        if source_folder is None:
+            done |= {os.path.join(self.faces_folder, path) for path in self.cache.cached_paths()}
+            folder = self.faces_folder
+        else:
+            folder = source_folder
+
+        jobs = []
+        for filename in sorted(os.listdir(folder)):
+            source_path = os.path.join(folder, filename)
+            if not filename.endswith(IMAGE_EXTENSIONS) or source_path in done:
+                continue
+            target_path = os.path.join(self.faces_folder, filename)
+            if source_folder is not None and os.path.exists(target_path):
+                # An identical copy (copy2 keeps size and mtime) that isn't checkpointed comes
+                # from an interrupted batch and may still lack its cache entry, account or
+                # journal record, so it's enrolled again; anything else is someone else's face
+                if not filecmp.cmp(source_path, target_path, shallow=True):
+                    self.counts["exists"] += 1
+                    continue
+            jobs.append((source_path, filename))
+        return jobs
+
+    def run(self, source_folder=None):
+        os.makedirs(self.faces_folder, exist_ok=True)
+        with self.cache.locked():
+            self.cache.fix_legacy_crops()
+        jobs = self.jobs(source_folder)
+        print(f"{len(jobs)} images to enroll with {self.workers} workers")
+
+        started = time.perf_counter()
+        batch = []
+        with multiprocessing.Pool(self.workers) as pool:
+            for result in pool.imap_unordered(encode_job, jobs, chunksize=8):
+                batch.append(result)
+                if len(batch) >= self.batch_size:
+                    self.commit(batch, source_folder)
+                    batch = []
+                    self.print_progress(len(jobs), started)
+            if batch:
+                self.commit(batch, source_folder)
+        self.print_progress(len(jobs), started)
+        print(f"Images without a face or unreadable are listed in {self.report_path}")
+
+    def commit(self, batch, source_folder):
+        results = []
+        enrolled = []
+        checkpoint = []
+        problems = []
+        for source_path, filename, encoding, error in batch:
+            status = "enrolled"
+            if error is not None:
+                status = "error"
+            elif encoding is None:
+                status = "no_face"
+            self.counts[status] += 1
+            checkpoint.append({"source": source_path, "status": status})
+
+            if status != "enrolled":
+                problems.append(f"{status}\t{source_path}\t{error or ''}")
+                if source_folder is None:
+                    # Remember faceless images in the cache so editions don't retry them
+                    results.append((image_key(source_path), None))
+                continue
+
+            target_path = os.path.join(self.faces_folder, filename)
+            if source_folder is not None:
+                shutil.copy2(source_path, target_path)
+            results.append((image_key(target_path), encoding))
+            enrolled.append((os.path.splitext(filename)[0], filename))
+
+        self.cache.merge(results)
+        ledger = Ledger()
+        ledger.open_accounts([name for name, _ in enrolled])
+        ledger.close()
+        self.journal.record_adds(enrolled)
+
+        if problems:
+            with open(self.report_path, "a") as file:
+                file.write("\n".join(problems) + "\n")
+        # The checkpoint is written last, a crash before this point only repeats the batch:
+        # copied images that aren't checkpointed are picked up again by jobs()
+        with open(self.checkpoint_path, "a") as file:
+            file.write("".join(json.dumps(entry) + "\n" for entry in checkpoint))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def print_progress(self, total, started):
+        processed = self.counts["enrolled"] + self.counts["no_face"] + self.counts["error"]
+        rate = processed / max(time.perf_counter() - started, 1e-9)
+        print(f"{processed}/{total} processed ({rate:.1f}/s): {self.counts['enrolled']} enrolled, "
+              f"{self.counts['no_face']} without a face, {self.counts['error']} errors, "
+              f"{self.counts['exists']} already enrolled")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-enroll customer photos into FacePOS")
+    parser.add_argument("source", nargs="?", help="folder of photos named <customer id>.jpg/.png; "
+                                                  "omit to encode images already in the faces folder")
+    parser.add_argument("--faces", default="faces")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--report", default=REPORT_PATH)
+    args = parser.parse_args()
+    BulkEnrollment(args.faces, args.checkpoint, args.report, args.workers, args.batch_size).run(args.source)
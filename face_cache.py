@@ -0,0 +1,301 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+from contextlib import contextmanager
+import numpy as np
+
+CACHE_FOLDER = "face_cache"
+IMAGE_EXTENSIONS = (".jpg", ".png")
+ENCODING_SIZE = 128
+CACHE_VERSION = 1
+# Written to the faces folder once the bank edition's old crops have been fixed
+CROPS_FIXED_MARKER = ".crops_fixed"
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def quantize(encodings, dtype):
+    # Returns (matrix, scales). int8 keeps one float32 scale per row, so a face takes
+    # 128 + 4 bytes; float16 takes 256 bytes and needs no scales.
+    encodings = np.asarray(encodings, dtype=np.float32)
+    if dtype == "float32":
+        return np.ascontiguousarray(encodings), None
+    if dtype == "float16":
+        return encodings.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(encodings).max(axis=1) / 127 if len(encodings) else np.empty(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1).astype(np.float32)
+        return np.round(encodings / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unsupported encoding dtype: {dtype}")
+
+
+def dequantize(matrix, scales):
+    if scales is None:
+        return np.asarray(matrix, dtype=np.float32)
+    return np.asarray(matrix, dtype=np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def image_key(path):
+    stat = os.stat(path)
+    return {"path": os.path.basename(path), "mtime": stat.st_mtime_ns, "size": stat.st_size,
+            "sha1": file_sha1(path)}
+
+
+def encode_image_file(path):
+    # Imported here so tools that only read the cache don't pay for dlib
+    import cv2
+    import face_recognition
+
+    face_image = cv2.imread(path)
+    if face_image is None:
+        return None
+    # Live frames are matched in RGB, so the gallery has to be encoded in RGB too
+    face_image = cv2.cvtColor(face_image, cv2.COLOR_BGR2RGB)
+    face_encodings = face_recognition.face_encodings(face_image)
+    if not face_encodings:
+        return None
+    return face_encodings[0]
+
+
+class FaceEncodingCache:
+    # The cache is a single (N, 128) float32 matrix stored as a .npy file plus a JSON
+    # index describing which image each row came from. Rows are keyed by the image path,
+    # mtime, size and SHA-1 so only new or changed images are re-encoded. Entries may carry
+    # extra metadata from enrollment (quality, time, terminal), kept as long as the image
+    # is unchanged.
+    def __init__(self, faces_folder="faces", cache_folder=CACHE_FOLDER):
+        self.faces_folder = faces_folder
+        self.cache_folder = cache_folder
+        self.index_path = os.path.join(cache_folder, "index.json")
+        self.lock_path = os.path.join(cache_folder, ".lock")
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {"version": CACHE_VERSION, "matrix": None, "entries": [], "no_face": {}}
+        with open(self.index_path, "r") as file:
+            index = json.load(file)
+        if index.get("version") != CACHE_VERSION:
+            return {"version": CACHE_VERSION, "matrix": None, "entries": [], "no_face": {}}
+        return index
+
+    def read_matrix(self, index, mmap=True):
+        if not index["matrix"] or not index["entries"]:
+            return np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        matrix_path = os.path.join(self.cache_folder, index["matrix"])
+        return np.load(matrix_path, mmap_mode="r" if mmap else None)
+
+    @contextmanager
+    def locked(self):
+        # Several editions and tools may update the cache at once, only one writes at a time
+        os.makedirs(self.cache_folder, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def quantized_paths(self, index, dtype):
+        stem = os.path.splitext(index["matrix"])[0]
+        return (os.path.join(self.cache_folder, f"{stem}-{dtype}.npy"),
+                os.path.join(self.cache_folder, f"{stem}-{dtype}-scales.npy"))
+
+    def write_quantized(self, index, dtype):
+        # float16/int8 copies of the matrix live next to it so every process can memory-map
+        # the same compact pages instead of quantizing a private copy
+        matrix_path, scales_path = self.quantized_paths(index, dtype)
+        if os.path.exists(matrix_path):
+            return
+        matrix, scales = quantize(self.read_matrix(index), dtype)
+        if scales is not None:
+            # Written before the matrix, whose presence marks the pair as complete
+            with open(scales_path + ".tmp", "wb") as file:
+                np.save(file, scales)
+            os.replace(scales_path + ".tmp", scales_path)
+        with open(matrix_path + ".tmp", "wb") as file:
+            np.save(file, matrix)
+        os.replace(matrix_path + ".tmp", matrix_path)
+
+    def read_quantized(self, index, dtype, mmap=True):
+        if dtype == "float32":
+            return self.read_matrix(index, mmap=mmap), None
+        if not index["matrix"] or not index["entries"]:
+            return quantize(np.empty((0, ENCODING_SIZE), dtype=np.float32), dtype)
+        matrix_path, scales_path = self.quantized_paths(index, dtype)
+        mmap_mode = "r" if mmap else None
+        scales = np.load(scales_path, mmap_mode=mmap_mode) if dtype == "int8" else None
+        return np.load(matrix_path, mmap_mode=mmap_mode), scales
+
+    def fix_legacy_crops(self):
+        # Older bank editions saved every crop with red and blue swapped (an RGB2BGR
+        # conversion of a BGR frame) and only matched them because their loader didn't
+        # convert either. Swaps those crops back once, so every image in the faces folder
+        # is a normal BGR file. Only bank IDs (42 and ten digits) are touched, and finished
+        # files are logged so an interrupted run doesn't swap anything twice.
+        # Call with the lock held, before anything new is written to the faces folder.
+        marker_path = os.path.join(self.faces_folder, CROPS_FIXED_MARKER)
+        if os.path.exists(marker_path):
+            return
+        import cv2
+
+        progress_path = marker_path + ".partial"
+        done = set()
+        if os.path.exists(progress_path):
+            with open(progress_path, "r") as file:
+                done = set(file.read().split())
+        with open(progress_path, "a") as progress:
+            for filename in sorted(os.listdir(self.faces_folder)):
+                stem, extension = os.path.splitext(filename)
+                if extension not in IMAGE_EXTENSIONS or not re.fullmatch(r"42\d{10}", stem) or filename in done:
+                    continue
+                path = os.path.join(self.faces_folder, filename)
+                image = cv2.imread(path)
+                if image is not None:
+                    ok, data = cv2.imencode(extension, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+                    if ok:
+                        with open(path + ".tmp", "wb") as file:
+                            file.write(data.tobytes())
+                        os.replace(path + ".tmp", path)
+                progress.write(filename + "\n")
+                progress.flush()
+        os.replace(progress_path, marker_path)
+
+    def load(self, mmap=True, dtype="float32"):
+        # Returns (names, encodings, scales) after bringing the cache up to date with the
+        # faces folder. encodings has the requested dtype, scales is only set for int8.
+        with self.locked():
+            self.fix_legacy_crops()
+            index = self.sync()
+            if dtype != "float32" and index["matrix"] and index["entries"]:
+                self.write_quantized(index, dtype)
+            # Opened under the lock: a later write removes this generation's files, but a
+            # memory map that is already open keeps them readable
+            encodings, scales = self.read_quantized(index, dtype, mmap=mmap)
+
+        names = [entry["name"] for entry in index["entries"]]
+        return names, encodings, scales
+
+    def cached_paths(self):
+        # Image filenames the cache already covers, with or without a face
+        index = self.read_index()
+        return {entry["path"] for entry in index["entries"]} | set(index["no_face"])
+
+    def merge(self, results):
+        # Store encodings computed elsewhere (e.g. by enroll.py) without re-encoding.
+        # results holds (key, encoding) pairs where key has the path, mtime, size and sha1
+        # of an image in the faces folder (plus any metadata to store with it) and encoding
+        # is None when it had no face.
+        with self.locked():
+            index = self.read_index()
+            matrix = self.read_matrix(index)
+            merged = {key["path"]: (key, encoding) for key, encoding in results}
+
+            entries, rows = [], []
+            for row, entry in enumerate(index["entries"]):
+                if entry["path"] not in merged:
+                    entries.append(entry)
+                    rows.append(matrix[row])
+            no_face = {path: key for path, key in index["no_face"].items() if path not in merged}
+
+            for key, encoding in merged.values():
+                if encoding is None:
+                    no_face[key["path"]] = key
+                else:
+                    entries.append(dict(key, name=os.path.splitext(key["path"])[0]))
+                    rows.append(encoding)
+
+            new_matrix = np.ascontiguousarray(rows, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            return self.write(index, entries, new_matrix, no_face)
+
+    def sync(self):
+        index = self.read_index()
+        matrix = self.read_matrix(index)
+        cached = {entry["path"]: (row, entry) for row, entry in enumerate(index["entries"])}
+        no_face = index["no_face"]
+
+        entries = []
+        rows = []
+        new_no_face = {}
+        pending = []
+        changed = False
+
+        for filename in sorted(os.listdir(self.faces_folder)):
+            if not filename.endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(self.faces_folder, filename)
+            stat = os.stat(path)
+            key = {"path": filename, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+            row, entry = cached.get(filename, (None, None))
+            previous = entry or no_face.get(filename)
+            if previous is not None and previous["mtime"] == key["mtime"] and previous["size"] == key["size"]:
+                unchanged = True
+                key["sha1"] = previous["sha1"]
+            else:
+                key["sha1"] = file_sha1(path)
+                unchanged = previous is not None and previous["sha1"] == key["sha1"]
+                # A touched but identical file only needs its mtime refreshed
+                changed = True
+
+            if unchanged and entry is not None:
+                entries.append(dict(entry, **key))
+                rows.append(matrix[row])
+            elif unchanged:
+                new_no_face[filename] = key
+            else:
+                pending.append((path, key))
+
+        for path, key in pending:
+            encoding = encode_image_file(path)
+            if encoding is None:
+                print(f"No face found in {key['path']}")
+                new_no_face[key["path"]] = key
+                continue
+            entries.append(dict(key, name=os.path.splitext(key["path"])[0]))
+            rows.append(encoding)
+
+        # Entries for deleted files simply aren't carried over
+        if len(entries) != len(index["entries"]) or len(new_no_face) != len(no_face):
+            changed = True
+        if not changed:
+            return index
+
+        new_matrix = np.ascontiguousarray(rows, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        return self.write(index, entries, new_matrix, new_no_face)
+
+    def write(self, index, entries, matrix, no_face):
+        # Each write goes to a new generation file and the index is swapped in with an
+        # atomic rename, so readers holding a memory map of the old matrix are unaffected
+        generation = index.get("generation", 0) + 1
+        matrix_name = f"encodings-{generation}.npy"
+        matrix_path = os.path.join(self.cache_folder, matrix_name)
+        with open(matrix_path + ".tmp", "wb") as file:
+            np.save(file, matrix)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(matrix_path + ".tmp", matrix_path)
+
+        new_index = {"version": CACHE_VERSION, "generation": generation, "matrix": matrix_name,
+                     "entries": entries, "no_face": no_face}
+        with open(self.index_path + ".tmp", "w") as file:
+            json.dump(new_index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+        if index["matrix"] and index["matrix"] != matrix_name:
+            # Drop the previous generation together with its quantized copies
+            old_stem = os.path.splitext(index["matrix"])[0]
+            for filename in os.listdir(self.cache_folder):
+                if filename == index["matrix"] or filename.startswith(old_stem + "-"):
+                    os.remove(os.path.join(self.cache_folder, filename))
+
+        return new_index
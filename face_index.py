@@ -0,0 +1,186 @@
+import numpy as np
+
+# Galleries smaller than this are always searched exhaustively, the IVF index only pays
+# off once a full scan costs more than probing a handful of clusters
+EXACT_SEARCH_LIMIT = 4096
+
+# How many times more clusters a query probes when the first probe found nobody
+WIDEN_FACTOR = 2
+
+# Rows decoded to float32 at a time, so a float16/int8 gallery is never expanded whole
+BLOCK_ROWS = 65536
+
+
+def squared_distances(queries, encodings, squared_norms):
+    return (np.einsum("ij,ij->i", queries, queries)[:, None]
+            + squared_norms[None, :]
+            - 2.0 * (queries @ encodings.T))
+
+
+def kmeans(data, clusters, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    data_norms = np.einsum("ij,ij->i", data, data)
+    for _ in range(iterations):
+        assignment = squared_distances(centroids, data, data_norms).argmin(axis=0)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class ExactIndex:
+    # Brute force over every live row of the gallery, used directly for small galleries
+    # and as the fallback when an approximate answer isn't good enough
+    def __init__(self):
+        self.gallery = None
+
+    def build(self, gallery):
+        self.gallery = gallery
+
+    def add(self, row):
+        pass
+
+    def remove(self, row):
+        pass
+
+    def search(self, queries, exact=False, fallback_distance=None):
+        # Scan block by block keeping the running best row per query
+        gallery = self.gallery
+        rows = np.full(len(queries), -1)
+        best = np.full(len(queries), np.inf, dtype=np.float32)
+        for start in range(0, gallery.count, BLOCK_ROWS):
+            squared = gallery.row_distances(queries, slice(start, min(start + BLOCK_ROWS, gallery.count)))
+            block_rows = squared.argmin(axis=1)
+            block_best = squared[np.arange(len(queries)), block_rows]
+            better = block_best < best
+            rows[better] = start + block_rows[better]
+            best[better] = block_best[better]
+        return rows, np.sqrt(np.maximum(best, 0.0))
+
+
+class IVFIndex(ExactIndex):
+    # Inverted file index: rows are partitioned into k-means clusters and a query only
+    # scans the nprobe clusters whose centroids are closest to it. nprobe is the
+    # recall/latency knob, nprobe >= nlist is equivalent to an exact search.
+    def __init__(self, nlist=None, nprobe=8, iterations=10, exact_limit=EXACT_SEARCH_LIMIT):
+        super().__init__()
+        self.requested_nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.exact_limit = exact_limit
+        self.centroids = None
+        self.centroid_norms = None
+        self.lists = []
+        # Cluster of every gallery row, -1 for rows not in any list; 4 bytes a face
+        self.row_lists = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+
+    def build(self, gallery):
+        super().build(gallery)
+        self.centroids = None
+        self.lists = []
+        self.row_lists = np.empty(0, dtype=np.int32)
+        if len(gallery) >= self.exact_limit:
+            self.train()
+
+    def train(self):
+        gallery = self.gallery
+        live_rows = gallery.live_rows()
+        nlist = self.requested_nlist or int(np.sqrt(len(live_rows)))
+        nlist = max(1, min(nlist, len(live_rows)))
+
+        rng = np.random.default_rng(0)
+        sample_rows = live_rows
+        if len(live_rows) > 64 * nlist:
+            sample_rows = rng.choice(live_rows, 64 * nlist, replace=False)
+        self.centroids = kmeans(gallery.vectors(np.sort(sample_rows)), nlist, self.iterations)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        assignment = np.concatenate([self.assign(gallery.vectors(live_rows[start:start + BLOCK_ROWS]))
+                                     for start in range(0, len(live_rows), BLOCK_ROWS)])
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self.lists = [live_rows[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+        self.row_lists = np.full(gallery.count, -1, dtype=np.int32)
+        self.row_lists[live_rows] = assignment
+        self.trained_size = len(live_rows)
+
+    def assign(self, encodings):
+        encodings = np.asarray(encodings, dtype=np.float32)
+        return squared_distances(encodings, self.centroids, self.centroid_norms).argmin(axis=1)
+
+    def add(self, row):
+        if self.centroids is None:
+            if len(self.gallery) >= self.exact_limit:
+                self.train()
+            return
+        if len(self.gallery) > 4 * self.trained_size:
+            # The clustering was fitted on a much smaller gallery, refit it
+            self.train()
+            return
+        if row >= len(self.row_lists):
+            row_lists = np.full(max(2 * len(self.row_lists), row + 1, 16), -1, dtype=np.int32)
+            row_lists[:len(self.row_lists)] = self.row_lists
+            self.row_lists = row_lists
+        self.remove(row)
+        list_id = int(self.assign(self.gallery.vectors(slice(row, row + 1)))[0])
+        self.lists[list_id] = np.append(self.lists[list_id], row)
+        self.row_lists[row] = list_id
+
+    def remove(self, row):
+        if row < len(self.row_lists) and self.row_lists[row] >= 0:
+            rows = self.lists[self.row_lists[row]]
+            self.lists[self.row_lists[row]] = rows[rows != row]
+            self.row_lists[row] = -1
+
+    def search(self, queries, exact=False, fallback_distance=None):
+        # Queries whose best probed row is farther than fallback_distance are probed again
+        # with WIDEN_FACTOR times the clusters, so a known face whose cluster lay just outside
+        # the first probe isn't reported as unknown. A stranger costs at most the wider
+        # probe; only exact=True scans the whole gallery.
+        if exact or self.centroids is None or self.nprobe >= len(self.centroids):
+            return super().search(queries)
+
+        rows, distances = self.probe(queries, self.nprobe)
+        if fallback_distance is not None:
+            missed = np.flatnonzero(~(distances <= fallback_distance))
+            if len(missed):
+                # The wider probe covers the first one, so it can only find closer rows
+                wider = min(self.nprobe * WIDEN_FACTOR, len(self.centroids))
+                rows[missed], distances[missed] = self.probe(queries[missed], wider)
+        return rows, distances
+
+    def probe(self, queries, nprobe):
+        gallery = self.gallery
+        centroid_distances = squared_distances(queries, self.centroids, self.centroid_norms)
+        if nprobe < len(self.centroids):
+            probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(len(self.centroids)), centroid_distances.shape)
+
+        rows = np.full(len(queries), -1)
+        distances = np.full(len(queries), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self.lists[list_id] for list_id in probes[i]])
+            if len(candidates) == 0:
+                continue
+            squared = gallery.row_distances(query[None, :], candidates)[0]
+            best = squared.argmin()
+            rows[i] = candidates[best]
+            distances[i] = np.sqrt(max(squared[best], 0.0))
+        return rows, distances
+
+
+def make_index(kind="ivf", **options):
+    if kind == "exact":
+        return ExactIndex()
+    if kind == "ivf":
+        return IVFIndex(**options)
+    raise ValueError(f"Unknown face index: {kind}")
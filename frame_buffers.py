@@ -0,0 +1,64 @@
+import threading
+import cv2
+import numpy as np
+
+
+class FrameBufferPool:
+    # Recycles frame-sized arrays. A buffer handed to the recognition worker stays leased
+    # until the worker releases it, so the camera loop never overwrites a frame that is
+    # still being recognized and, once warmed up, never allocates a new one either.
+    def __init__(self):
+        self.free = []
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self, shape):
+        with self.lock:
+            while self.free:
+                buffer = self.free.pop()
+                if buffer.shape == shape:
+                    return buffer
+                # Resolution changed, let the old buffer go
+                self.allocated -= 1
+            self.allocated += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        with self.lock:
+            self.free.append(buffer)
+
+
+class FramePipeline:
+    # Resizes camera frames to the preview width and converts them to RGB into persistent
+    # buffers instead of allocating two new images per tick. The RGB buffer is shown
+    # through a QImage that points at it and is then passed on to recognition as is.
+    def __init__(self, width=800, pool=None):
+        self.width = width
+        self.pool = pool or FrameBufferPool()
+        self.resized = None
+
+    def process(self, frame):
+        # Returns an RGB buffer from the pool, give it back with release() when done
+        height, width = frame.shape[:2]
+        if width != self.width:
+            size = (self.width, int(height * self.width / width))
+            if self.resized is None or self.resized.shape[:2] != (size[1], size[0]):
+                self.resized = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            cv2.resize(frame, size, dst=self.resized, interpolation=cv2.INTER_AREA)
+            frame = self.resized
+
+        rgb_frame = self.pool.acquire(frame.shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb_frame)
+        return rgb_frame
+
+    def release(self, rgb_frame):
+        self.pool.release(rgb_frame)
+
+    def preview(self, rgb_frame):
+        # QImage over the buffer without copying it, QPixmap.fromImage makes the one copy
+        # the widget needs
+        from PyQt5.QtGui import QImage, QPixmap
+
+        height, width = rgb_frame.shape[:2]
+        q_image = QImage(rgb_frame.data, width, height, rgb_frame.strides[0], QImage.Format_RGB888)
+        return QPixmap.fromImage(q_image)
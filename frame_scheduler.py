@@ -0,0 +1,119 @@
+import time
+import cv2
+import numpy as np
+from PyQt5.QtCore import QTimer
+from metrics import metrics
+
+
+class MotionDetector:
+    # Compares a tiny grayscale thumbnail of each frame with the previous one; the mean
+    # absolute difference (0-255) above threshold counts as motion
+    def __init__(self, threshold=6.0, size=(64, 48)):
+        self.threshold = threshold
+        self.size = size
+        self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self.gray = np.empty((size[1], size[0]), dtype=np.uint8)
+        self.previous = None
+
+    def update(self, rgb_frame):
+        cv2.resize(rgb_frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        if self.previous is None:
+            self.previous = self.gray.copy()
+            return False
+        moved = cv2.absdiff(self.gray, self.previous).mean() > self.threshold
+        self.previous[:] = self.gray
+        return moved
+
+
+class FrameScheduler:
+    # Drives the camera loop with a single-shot timer instead of a fixed interval. After
+    # every tick the next one is scheduled from the measured tick cost, so the main
+    # thread spends at most about half its time on frames and Qt events never pile up.
+    # Recognition gets its own rate, following how long the worker actually takes.
+    # When no face has been seen for idle_after seconds the loop drops to idle_interval
+    # and stops recognizing; motion in the preview wakes it up again straight away.
+    def __init__(self, tick, parent=None, preview_interval=30, max_preview_interval=250, idle_interval=500,
+                 recognition_interval=100, idle_after=10.0, motion_threshold=6.0, worker=None):
+        self.tick = tick
+        self.preview_interval = preview_interval
+        self.max_preview_interval = max_preview_interval
+        self.idle_interval = idle_interval
+        self.recognition_interval = recognition_interval
+        self.idle_after = idle_after
+        self.worker = worker
+        self.motion = MotionDetector(motion_threshold)
+        self.tick_seconds = 0.0
+        self.last_face = time.monotonic()
+        self.last_recognition = 0.0
+        self.idle = False
+        self.running = False
+        self.timer = QTimer(parent)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run_tick)
+
+    def start(self):
+        self.running = True
+        self.timer.start(0)
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def run_tick(self):
+        began = time.perf_counter()
+        try:
+            self.tick()
+        finally:
+            cost = time.perf_counter() - began
+            # Smoothed so one slow frame doesn't halve the preview rate
+            self.tick_seconds = 0.8 * self.tick_seconds + 0.2 * cost
+            if self.running:
+                self.timer.start(self.next_interval())
+
+    def next_interval(self):
+        if self.idle:
+            return self.idle_interval
+        interval = int(2000 * self.tick_seconds)
+        return min(max(interval, self.preview_interval), self.max_preview_interval)
+
+    def observe(self, rgb_frame):
+        # Called by the tick with the frame it just showed, returns False while idle
+        now = time.monotonic()
+        moved = self.motion.update(rgb_frame)
+        if self.idle:
+            if not moved:
+                return False
+            self.wake(now)
+        elif now - self.last_face > self.idle_after and not moved:
+            self.idle = True
+            metrics.count("scheduler_idle")
+            return False
+        return True
+
+    def should_recognize(self, rgb_frame):
+        # observe() plus the recognition rate; True means hand the frame to recognition
+        if not self.observe(rgb_frame):
+            return False
+        now = time.monotonic()
+        # No point submitting faster than the worker gets through frames
+        interval = self.recognition_interval / 1000
+        if self.worker is not None:
+            interval = max(interval, self.worker.recognition_seconds)
+        if now - self.last_recognition < interval:
+            return False
+        self.last_recognition = now
+        return True
+
+    def faces_seen(self, count):
+        if count:
+            self.wake(time.monotonic())
+
+    def wake(self, now):
+        self.last_face = now
+        if self.idle:
+            self.idle = False
+            metrics.count("scheduler_wake")
+            if self.running:
+                # Don't wait out the rest of a long idle interval
+                self.timer.start(0)
@@ -0,0 +1,82 @@
+import os
+import cv2
+from face_cache import IMAGE_EXTENSIONS
+
+# Point the editions at a recording instead of the webcam, e.g. FACEPOS_CAMERA=till3.mp4
+# or FACEPOS_CAMERA=frames/ for a folder of images
+SOURCE_ENV = "FACEPOS_CAMERA"
+
+
+class VideoFileSource:
+    # Replays a video file frame by frame with the same read/start/stop interface as
+    # imutils' VideoStream. Every read returns the next frame, so a replay is the same
+    # sequence no matter how fast it is consumed. With loop the file starts over at the
+    # end, otherwise read returns None.
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.capture = None
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open video {self.path}")
+        return self
+
+    def read(self):
+        ok, frame = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class ImageDirectorySource:
+    # Replays the images in a folder in filename order, decoded once up front so reads
+    # cost the same as grabbing a frame from a camera
+    def __init__(self, folder, loop=True):
+        self.folder = folder
+        self.loop = loop
+        self.frames = []
+        self.position = 0
+
+    def start(self):
+        for filename in sorted(os.listdir(self.folder)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(self.folder, filename))
+                if frame is not None:
+                    self.frames.append(frame)
+        if not self.frames:
+            raise ValueError(f"No images in {self.folder}")
+        return self
+
+    def read(self):
+        if self.position >= len(self.frames):
+            if not self.loop:
+                return None
+            self.position = 0
+        frame = self.frames[self.position]
+        self.position += 1
+        # Callers may draw on the frame, keep the decoded copy intact for the next loop
+        return frame.copy()
+
+    def stop(self):
+        self.frames = []
+
+
+def open_frame_source(source=None, loop=True):
+    # source is a camera index, a video file or a folder of images; None uses
+    # FACEPOS_CAMERA and falls back to the first webcam
+    if source is None:
+        source = os.environ.get(SOURCE_ENV) or 0
+    if isinstance(source, int) or str(source).isdigit():
+        from imutils.video import VideoStream
+        return VideoStream(src=int(source)).start()
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, loop).start()
+    return VideoFileSource(source, loop).start()
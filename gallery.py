@@ -0,0 +1,192 @@
+from collections import namedtuple
+import threading
+import numpy as np
+from face_cache import ENCODING_SIZE, FaceEncodingCache, dequantize, quantize
+from face_index import BLOCK_ROWS, make_index
+from gallery_journal import GalleryJournal
+
+# Same default as face_recognition.compare_faces
+DEFAULT_TOLERANCE = 0.6
+
+FaceMatch = namedtuple("FaceMatch", ["name", "distance", "index"])
+
+
+class FaceGallery:
+    # All known encodings live in one contiguous (N, 128) matrix, stored as float32 or,
+    # to save memory, float16 (256 bytes a face) or int8 with a float32 scale per row
+    # (132 bytes a face). IDs sit in a parallel fixed-width bytes array with a dict for the
+    # reverse lookup, so a face costs no Python objects besides its dict entry. Matrices
+    # loaded from the cache are memory-mapped and their pages shared between processes.
+    # Removed rows are tombstoned (empty ID, infinite norm) so row numbers stay stable for
+    # the index.
+    def __init__(self, names=None, encodings=None, tolerance=DEFAULT_TOLERANCE, index=None,
+                 dtype="float32", scales=None):
+        names = list(names) if names is not None else []
+        if encodings is None:
+            encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.dtype = np.dtype(dtype).name
+        encodings = np.asarray(encodings)
+        if encodings.dtype != self.dtype or (self.dtype == "int8" and scales is None):
+            encodings, scales = quantize(np.asarray(encodings).reshape(-1, ENCODING_SIZE), self.dtype)
+        self.buffer = encodings
+        self.scales = scales
+        self.count = len(names)
+        self.ids = np.array([name.encode() for name in names] or [b""], dtype=bytes)[:self.count]
+        self.rows_by_name = {name: row for row, name in enumerate(names)}
+        # Sorted copy of the live IDs for prefix search, rebuilt on the first search after a change
+        self.sorted_ids = None
+        self.squared_norms = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = self.vectors(slice(start, start + BLOCK_ROWS))
+            self.squared_norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+        self.tolerance = tolerance
+        # Recognition may run on a worker thread while enrollment mutates the gallery
+        self.lock = threading.RLock()
+        self.index = index if index is not None else make_index()
+        self.index.build(self)
+        self.journal_offset = 0
+
+    @classmethod
+    def load(cls, faces_folder="faces", tolerance=DEFAULT_TOLERANCE, index=None, dtype="float32"):
+        # Remember where the change journal ended before reading the cache, so a watcher
+        # started later replays anything enrolled while the gallery was loading
+        journal_offset = GalleryJournal().end_offset()
+        names, encodings, scales = FaceEncodingCache(faces_folder).load(dtype=dtype)
+        gallery = cls(names, encodings, tolerance, index, dtype, scales)
+        gallery.journal_offset = journal_offset
+        return gallery
+
+    @property
+    def names(self):
+        return [name.decode() for name in self.ids[:self.count] if name]
+
+    @property
+    def nbytes(self):
+        # Bytes held by the gallery arrays, memory-mapped ones included
+        scales_bytes = self.scales.nbytes if self.scales is not None else 0
+        return self.buffer.nbytes + scales_bytes + self.ids.nbytes + self.squared_norms.nbytes
+
+    def __len__(self):
+        return len(self.rows_by_name)
+
+    def __contains__(self, name):
+        return name in self.rows_by_name
+
+    def name_of(self, row):
+        return self.ids[row].decode()
+
+    def search(self, prefix="", start=0, limit=100):
+        # IDs starting with prefix in sorted order: (number of matches, the matches from
+        # start to start + limit). Two binary searches over the sorted ID array, so a page
+        # costs the same whatever the gallery size.
+        with self.lock:
+            if self.sorted_ids is None:
+                ids = self.ids[:self.count]
+                self.sorted_ids = np.sort(ids[ids != b""])
+            sorted_ids = self.sorted_ids
+        prefix = prefix.encode()
+        low, high = np.searchsorted(sorted_ids, np.array([prefix, prefix + b"\xff"]))
+        page = sorted_ids[min(low + start, high):min(low + start + limit, high)]
+        return int(high - low), [name.decode() for name in page]
+
+    def live_rows(self):
+        return np.fromiter(sorted(self.rows_by_name.values()), dtype=np.int64, count=len(self.rows_by_name))
+
+    def vectors(self, rows):
+        # float32 encodings for a slice or an array of row numbers
+        return dequantize(self.buffer[rows], self.scales[rows] if self.scales is not None else None)
+
+    def row_distances(self, queries, rows):
+        # Squared distances from every query to the given rows, shape (M, len(rows))
+        return (np.einsum("ij,ij->i", queries, queries)[:, None]
+                + self.squared_norms[rows][None, :]
+                - 2.0 * (queries @ self.vectors(rows).T))
+
+    def grow(self, capacity):
+        # Grow geometrically; this also copies a read-only memory-mapped cache
+        buffer = np.empty((capacity, ENCODING_SIZE), dtype=self.buffer.dtype)
+        buffer[:self.count] = self.buffer[:self.count]
+        self.buffer = buffer
+        if self.scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self.count] = self.scales[:self.count]
+            self.scales = scales
+        norms = np.full(capacity, np.inf, dtype=np.float32)
+        norms[:self.count] = self.squared_norms[:self.count]
+        self.squared_norms = norms
+        ids = np.zeros(capacity, dtype=self.ids.dtype)
+        ids[:self.count] = self.ids[:self.count]
+        self.ids = ids
+
+    def add(self, name, encoding):
+        encoding, scale = quantize(np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_SIZE), self.dtype)
+        with self.lock:
+            row = self.rows_by_name.get(name)
+            if not self.buffer.flags.writeable:
+                self.grow(max(2 * self.count, 16))
+            if row is None:
+                row = self.count
+                if row >= len(self.buffer):
+                    self.grow(max(2 * len(self.buffer), 16))
+                encoded_name = name.encode()
+                if len(encoded_name) > self.ids.dtype.itemsize:
+                    # Widen the fixed-width ID array for a longer name
+                    self.ids = self.ids.astype(f"S{len(encoded_name)}")
+                self.ids[row] = encoded_name
+                self.rows_by_name[name] = row
+                self.count += 1
+                self.sorted_ids = None
+
+            self.buffer[row] = encoding[0]
+            if self.scales is not None:
+                self.scales[row] = scale[0]
+            vector = self.vectors(slice(row, row + 1))[0]
+            self.squared_norms[row] = vector @ vector
+            self.index.add(row)
+            return row
+
+    def remove(self, name):
+        with self.lock:
+            row = self.rows_by_name.pop(name, None)
+            if row is None:
+                return False
+            self.ids[row] = b""
+            self.sorted_ids = None
+            self.squared_norms[row] = np.inf
+            self.index.remove(row)
+            return True
+
+    def apply_changes(self, added, removed):
+        # Apply a batch of enrollments ({name: encoding}) and deregistrations at once;
+        # recognition sees either none or all of the batch
+        with self.lock:
+            for name in removed:
+                self.remove(name)
+            for name, encoding in added.items():
+                self.add(name, encoding)
+
+    def match(self, face_encodings, exact=False):
+        # One FaceMatch per query encoding; name is None when nothing is within tolerance
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [FaceMatch(None, float("inf"), -1) for _ in face_encodings]
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        with self.lock:
+            rows, distances = self.index.search(queries, exact=exact, fallback_distance=self.tolerance)
+
+            matches = []
+            for row, distance in zip(rows.tolist(), distances.tolist()):
+                if row >= 0 and distance <= self.tolerance:
+                    matches.append(FaceMatch(self.name_of(row), distance, row))
+                else:
+                    matches.append(FaceMatch(None, distance, -1))
+            return matches
+
+    def best_match(self, face_encodings, exact=False):
+        # Closest known face over every face in the frame, or None if nobody matched
+        matches = [match for match in self.match(face_encodings, exact) if match.name is not None]
+        if not matches:
+            return None
+        return min(matches, key=lambda match: match.distance)
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from face_cache import CACHE_FOLDER, FaceEncodingCache, encode_image_file
+
+JOURNAL_PATH = os.path.join(CACHE_FOLDER, "journal.log")
+
+
+class GalleryJournal:
+    # Append-only log of enrollments and deregistrations shared by every edition. Each line
+    # is one JSON record; readers remember the byte offset they have consumed up to.
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+
+    def append(self, *records):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = "".join(json.dumps(record) + "\n" for record in records).encode()
+        # A single O_APPEND write doesn't interleave with other processes' appends
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def record_add(self, name, filename):
+        self.append({"op": "add", "name": name, "file": filename, "time": time.time()})
+
+    def record_adds(self, names_and_filenames):
+        now = time.time()
+        self.append(*({"op": "add", "name": name, "file": filename, "time": now}
+                      for name, filename in names_and_filenames))
+
+    def record_remove(self, name):
+        self.append({"op": "remove", "name": name, "time": time.time()})
+
+    def end_offset(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read_from(self, offset):
+        # Returns the complete records after offset and the offset to continue from
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, offset + end
+
+
+class GalleryWatcher(threading.Thread):
+    # Follows the journal and applies new enrollments and deregistrations to a running
+    # gallery. Added images are encoded here, off the UI and recognition threads, and the
+    # whole batch is applied to the gallery in one step.
+    def __init__(self, gallery, faces_folder="faces", journal=None, interval=1.0):
+        super().__init__(daemon=True)
+        self.gallery = gallery
+        self.faces_folder = faces_folder
+        self.journal = journal or GalleryJournal()
+        self.interval = interval
+        self.offset = gallery.journal_offset
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Gallery refresh failed: {e}")
+
+    def poll(self):
+        records, offset = self.journal.read_from(self.offset)
+        if not records:
+            return
+
+        # Only the last record per name matters within a batch
+        latest = {}
+        for record in records:
+            latest[record["name"]] = record
+
+        # Bulk enrollment stores encodings in the shared cache before announcing them,
+        # only images the cache doesn't cover yet are encoded here
+        cache = FaceEncodingCache(self.faces_folder)
+        with cache.locked():
+            index = cache.read_index()
+            matrix = cache.read_matrix(index)
+        cached_rows = {entry["path"]: (row, entry) for row, entry in enumerate(index["entries"])}
+
+        added, removed = {}, []
+        for name, record in latest.items():
+            if record["op"] == "remove":
+                removed.append(name)
+                continue
+            path = os.path.join(self.faces_folder, record["file"])
+            if not os.path.exists(path):
+                continue
+            row, entry = cached_rows.get(record["file"], (None, None))
+            stat = os.stat(path)
+            if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                encoding = matrix[row]
+            else:
+                encoding = encode_image_file(path)
+            if encoding is None:
+                print(f"No face found in {record['file']}")
+                continue
+            added[name] = encoding
+
+        self.gallery.apply_changes(added, removed)
+        self.offset = offset
+
+    def stop(self):
+        self.stopped.set()
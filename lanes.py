@@ -0,0 +1,141 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from detection import FaceDetector
+from frame_buffers import FramePipeline
+from metrics import metrics
+from track_cache import TrackIdentityCache
+
+
+def batch_face_encodings(rgb_frames, boxes_per_frame):
+    # Encodes the faces of several frames with one call into dlib's batch descriptor API,
+    # returns a list of encodings per frame. Same landmarks model (5 point) and jitter as
+    # face_recognition.face_encodings, so the results match the enrolled encodings.
+    import dlib
+    import face_recognition
+    from face_recognition import api
+
+    images, detections = [], []
+    for rgb_frame, boxes in zip(rgb_frames, boxes_per_frame):
+        if not boxes:
+            continue
+        shapes = dlib.full_object_detections()
+        for top, right, bottom, left in boxes:
+            shapes.append(api.pose_predictor_5_point(rgb_frame, dlib.rectangle(left, top, right, bottom)))
+        images.append(rgb_frame)
+        detections.append(shapes)
+    if not images:
+        return [[] for _ in rgb_frames]
+
+    try:
+        batches = api.face_encoder.compute_face_descriptor(images, detections, 1)
+    except (TypeError, RuntimeError):
+        # dlib builds without the batch overload, encode frame by frame
+        batches = [face_recognition.face_encodings(rgb_frame, boxes)
+                   for rgb_frame, boxes in zip(rgb_frames, boxes_per_frame) if boxes]
+
+    batches = iter(batches)
+    return [[np.array(descriptor) for descriptor in next(batches)] if boxes else []
+            for boxes in boxes_per_frame]
+
+
+class Lane:
+    # One checkout lane: its camera, frame buffers, detector with its own box tracker,
+    # track cache and the customer currently identified at the till
+    def __init__(self, lane_id, video_stream, tolerance, width=640, detect_every=5):
+        self.lane_id = lane_id
+        self.video_stream = video_stream
+        self.frame_pipeline = FramePipeline(width=width)
+        self.detector = FaceDetector(scale=0.5, detect_every=detect_every, model="hog", upsample=1)
+        self.track_cache = TrackIdentityCache(tolerance=tolerance)
+        self.current_face = None
+
+    def read(self):
+        # Next RGB frame from the pool, or None when the source has nothing
+        frame = self.video_stream.read()
+        if frame is None:
+            return None
+        return self.frame_pipeline.process(frame)
+
+    def detect(self, rgb_frame):
+        # Returns the tracks that need (re-)identification in this frame
+        tracks = self.track_cache.update(self.detector.detect(rgb_frame))
+        metrics.count("faces_detected", len(tracks))
+        return [track for track in tracks if self.track_cache.needs_verification(track)]
+
+    def update_current_face(self):
+        identified = self.track_cache.identified()
+        self.current_face = identified.name if identified is not None else None
+        return self.current_face
+
+
+class LaneRecognitionWorker(QThread):
+    # Recognition for every lane of a checkout process. The newest frame of each lane is
+    # kept; a round detects on all pending lanes in parallel, then encodes all stale face
+    # tracks with one batched call and matches them against the shared gallery with one
+    # search, so adding a lane adds faces to a batch rather than another process with its
+    # own gallery copy.
+    lane_recognized = pyqtSignal(int, object)
+
+    def __init__(self, gallery, lanes, parent=None):
+        super().__init__(parent)
+        self.gallery = gallery
+        self.lanes = lanes
+        self.condition = threading.Condition()
+        self.pending_frames = {}
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(lanes)))
+
+    def submit(self, lane, rgb_frame):
+        with self.condition:
+            dropped_frame = self.pending_frames.get(lane.lane_id)
+            self.pending_frames[lane.lane_id] = rgb_frame
+            self.condition.notify()
+        if dropped_frame is not None:
+            metrics.count("frames_dropped")
+            lane.frame_pipeline.release(dropped_frame)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending_frames:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                pending_frames = self.pending_frames
+                self.pending_frames = {}
+
+            lanes = [self.lanes[lane_id] for lane_id in pending_frames]
+            frames = [pending_frames[lane.lane_id] for lane in lanes]
+            try:
+                self.recognize(lanes, frames)
+            except Exception as e:
+                print(f"Lane recognition failed: {e}")
+            finally:
+                for lane, rgb_frame in zip(lanes, frames):
+                    lane.frame_pipeline.release(rgb_frame)
+
+    def recognize(self, lanes, frames):
+        with metrics.span("lane_detect"):
+            stale_tracks = list(self.executor.map(lambda lane, rgb_frame: lane.detect(rgb_frame), lanes, frames))
+
+        with metrics.span("lane_encode"):
+            encodings = batch_face_encodings(frames, [[track.box for track in tracks] for tracks in stale_tracks])
+        flat_encodings = [encoding for lane_encodings in encodings for encoding in lane_encodings]
+        if flat_encodings:
+            with metrics.span("lane_match"):
+                matches = iter(self.gallery.match(flat_encodings))
+            for lane, tracks in zip(lanes, stale_tracks):
+                for track in tracks:
+                    lane.track_cache.verify(track, next(matches))
+
+        for lane in lanes:
+            self.lane_recognized.emit(lane.lane_id, lane.update_current_face())
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+        self.executor.shutdown()
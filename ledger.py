@@ -0,0 +1,300 @@
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from metrics import metrics
+
+LEDGER_PATH = "ledger.db"
+
+# Bank-wide figures kept up to date by triggers inside every writing transaction, whichever
+# terminal or tool makes the change, so reading them never scans the accounts
+AGGREGATE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS account_totals (
+        kind TEXT PRIMARY KEY,
+        accounts INTEGER NOT NULL,
+        nonzero INTEGER NOT NULL,
+        total INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS merchant_totals (
+        account_id TEXT PRIMARY KEY,
+        received INTEGER NOT NULL,
+        payments INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS merchant_totals_received ON merchant_totals (received)",
+    """CREATE TRIGGER IF NOT EXISTS accounts_opened AFTER INSERT ON accounts BEGIN
+        INSERT INTO account_totals (kind, accounts, nonzero, total) VALUES (NEW.kind, 1, NEW.balance != 0, NEW.balance)
+            ON CONFLICT (kind) DO UPDATE SET accounts = accounts + 1, nonzero = nonzero + excluded.nonzero,
+            total = total + excluded.total;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS accounts_closed AFTER DELETE ON accounts BEGIN
+        UPDATE account_totals SET accounts = accounts - 1, nonzero = nonzero - (OLD.balance != 0),
+            total = total - OLD.balance WHERE kind = OLD.kind;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS accounts_balance_changed AFTER UPDATE OF balance ON accounts BEGIN
+        UPDATE account_totals SET nonzero = nonzero + (NEW.balance != 0) - (OLD.balance != 0),
+            total = total + NEW.balance - OLD.balance WHERE kind = NEW.kind;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_merchant_received AFTER INSERT ON transactions
+    WHEN NEW.credit_account LIKE 'business:%' BEGIN
+        INSERT INTO merchant_totals (account_id, received, payments) VALUES (NEW.credit_account, NEW.amount, 1)
+            ON CONFLICT (account_id) DO UPDATE SET received = received + excluded.received, payments = payments + 1;
+    END""",
+]
+
+
+class LedgerError(Exception):
+    pass
+
+
+class UnknownAccount(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+def business_account(business_name):
+    # Business and civilian accounts share one table, business names get a prefix so they
+    # can never collide with a 42xxxxxxxxxx customer ID
+    return f"business:{business_name}"
+
+
+def to_cents(amount):
+    return int(round(float(amount) * 100))
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+class Ledger:
+    # All balances in a single SQLite database in WAL mode. Amounts are stored as integer
+    # cents, every debit/credit pair is one transaction, and synchronous=NORMAL means
+    # commits only append to the WAL; fsync happens at checkpoints instead of per write.
+    # The group-commit writer in ledger_writer.py commits with FULL instead.
+    def __init__(self, path=LEDGER_PATH, balances_folder="balances", business_folder="business"):
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA busy_timeout=30000")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        if self.get_meta("aggregates_built") is None:
+            self.build_aggregates()
+        if self.get_meta("imported") is None:
+            self.import_text_files(balances_folder, business_folder)
+
+    def create_tables(self):
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                balance INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                operation TEXT NOT NULL,
+                debit_account TEXT,
+                credit_account TEXT,
+                amount INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def build_aggregates(self):
+        # Installs the aggregate triggers and fills the tables from one scan of the existing
+        # ledger, in the same transaction so no concurrent posting is missed or counted twice
+        with self.transaction() as connection:
+            if self.get_meta("aggregates_built") is not None:
+                return
+            for statement in AGGREGATE_SCHEMA:
+                connection.execute(statement)
+            connection.execute("DELETE FROM account_totals")
+            connection.execute("INSERT INTO account_totals (kind, accounts, nonzero, total) "
+                               "SELECT kind, COUNT(*), SUM(balance != 0), SUM(balance) FROM accounts GROUP BY kind")
+            connection.execute("DELETE FROM merchant_totals")
+            connection.execute("INSERT INTO merchant_totals (account_id, received, payments) "
+                               "SELECT credit_account, SUM(amount), COUNT(*) FROM transactions "
+                               "WHERE credit_account LIKE 'business:%' GROUP BY credit_account")
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aggregates_built', ?)",
+                               (str(time.time()),))
+
+    @contextmanager
+    def transaction(self):
+        # Several terminals can share the database. Readers never block in WAL mode, but
+        # SQLite has a single writer: BEGIN IMMEDIATE takes the database-wide write lock, so
+        # writes from all terminals still run one at a time, even on unrelated accounts.
+        # What keeps that cheap is that every write is a conditional UPDATE and the lock is
+        # only held for a few statements (loadgen: about 13k tx/s from one process, 8k tx/s
+        # from 16 processes, p99 13 ms). BEGIN IMMEDIATE waits for the lock (up to the
+        # connection timeout) instead of failing halfway through a transfer with SQLITE_BUSY.
+        began = time.perf_counter()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            metrics.count("ledger_rollbacks")
+            raise
+        self.connection.execute("COMMIT")
+        # Includes waiting for the write lock held by other terminals
+        metrics.observe("ledger_write_seconds", time.perf_counter() - began)
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def open_account(self, account_id, kind="civilian", balance=0.0):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO accounts (id, kind, balance) VALUES (?, ?, ?)",
+                               (account_id, kind, to_cents(balance)))
+
+    def open_accounts(self, account_ids, kind="civilian"):
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO accounts (id, kind, balance) VALUES (?, ?, 0)",
+                                   [(account_id, kind) for account_id in account_ids])
+
+    def close_account(self, account_id):
+        with self.transaction() as connection:
+            cursor = connection.execute("DELETE FROM accounts WHERE id = ? AND balance = 0", (account_id,))
+            if cursor.rowcount == 0:
+                self.read_balance(connection, account_id)
+                raise LedgerError(f"Account {account_id} still holds funds")
+
+    def has_account(self, account_id):
+        row = self.connection.execute("SELECT 1 FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        return row is not None
+
+    def read_balance(self, connection, account_id):
+        row = connection.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            raise UnknownAccount(account_id)
+        return row[0]
+
+    def balance(self, account_id):
+        return from_cents(self.read_balance(self.connection, account_id))
+
+    def balances(self, account_ids=None):
+        if account_ids is None:
+            rows = self.connection.execute("SELECT id, balance FROM accounts")
+        else:
+            account_ids = list(account_ids)
+            rows = []
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(account_ids), 500):
+                chunk = account_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self.connection.execute(
+                    f"SELECT id, balance FROM accounts WHERE id IN ({placeholders})", chunk))
+        return {account_id: from_cents(cents) for account_id, cents in rows}
+
+    def record(self, connection, operation, debit_account, credit_account, cents):
+        connection.execute("INSERT INTO transactions (created_at, operation, debit_account, credit_account, amount) "
+                           "VALUES (?, ?, ?, ?, ?)", (time.time(), operation, debit_account, credit_account, cents))
+
+    def credit(self, connection, account_id, cents):
+        cursor = connection.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (cents, account_id))
+        if cursor.rowcount == 0:
+            raise UnknownAccount(account_id)
+
+    def debit(self, connection, account_id, cents, allow_negative=False):
+        # The funds check is part of the UPDATE itself, so it holds against any concurrent
+        # writer without reading the balance into Python first
+        if allow_negative:
+            cursor = connection.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (cents, account_id))
+        else:
+            cursor = connection.execute("UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance >= ?",
+                                        (cents, account_id, cents))
+        if cursor.rowcount == 0:
+            self.read_balance(connection, account_id)
+            raise InsufficientFunds(account_id)
+
+    def adjust(self, account_id, amount, operation="adjust", allow_negative=True):
+        # Add amount (which may be negative) to one account, returns the new balance
+        cents = to_cents(amount)
+        with self.transaction() as connection:
+            if cents >= 0:
+                self.credit(connection, account_id, cents)
+                self.record(connection, operation, None, account_id, cents)
+            else:
+                self.debit(connection, account_id, -cents, allow_negative)
+                self.record(connection, operation, account_id, None, -cents)
+            balance = self.read_balance(connection, account_id)
+        return from_cents(balance)
+
+    def transfer(self, from_account, to_account, amount, operation="transfer"):
+        # Move amount between two accounts atomically, returns both new balances
+        cents = to_cents(amount)
+        if cents < 0:
+            raise ValueError("Transfer amount must not be negative")
+        with self.transaction() as connection:
+            self.debit(connection, from_account, cents)
+            self.credit(connection, to_account, cents)
+            self.record(connection, operation, from_account, to_account, cents)
+            from_balance = self.read_balance(connection, from_account)
+            to_balance = self.read_balance(connection, to_account)
+        return from_cents(from_balance), from_cents(to_balance)
+
+    def post_many(self, postings):
+        # Applies (debit_account, credit_account, cents, operation, allow_negative) postings
+        # in a single transaction, either account may be None for a top-up or withdrawal.
+        # Each posting runs in its own savepoint, so a declined one doesn't undo the rest of
+        # the group. Returns None for every applied posting and the LedgerError for the others.
+        results = []
+        with self.transaction() as connection:
+            for debit_account, credit_account, cents, operation, allow_negative in postings:
+                connection.execute("SAVEPOINT posting")
+                try:
+                    if debit_account is not None:
+                        self.debit(connection, debit_account, cents, allow_negative)
+                    if credit_account is not None:
+                        self.credit(connection, credit_account, cents)
+                    self.record(connection, operation, debit_account, credit_account, cents)
+                except LedgerError as e:
+                    connection.execute("ROLLBACK TO posting")
+                    results.append(e)
+                else:
+                    results.append(None)
+                connection.execute("RELEASE posting")
+        return results
+
+    def import_text_files(self, balances_folder="balances", business_folder="business"):
+        # One-off migration of balances/<id>_balance.txt and line 4 of business/<name>.txt.
+        # Accounts that already exist in the ledger are left untouched.
+        accounts = []
+        if os.path.isdir(balances_folder):
+            for filename in os.listdir(balances_folder):
+                if filename.endswith("_balance.txt"):
+                    with open(os.path.join(balances_folder, filename), "r") as file:
+                        balance = file.read().strip() or "0"
+                    accounts.append((filename[:-len("_balance.txt")], "civilian", to_cents(balance)))
+        if os.path.isdir(business_folder):
+            for filename in os.listdir(business_folder):
+                if filename.endswith(".txt"):
+                    with open(os.path.join(business_folder, filename), "r") as file:
+                        data = file.read().splitlines()
+                    if len(data) >= 4:
+                        accounts.append((business_account(data[0]), "business", to_cents(data[3])))
+
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO accounts (id, kind, balance) VALUES (?, ?, ?)", accounts)
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(time.time()),))
+        return len(accounts)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # python3 ledger.py import  re-runs the text file migration for accounts not yet in the ledger
+    if sys.argv[1:] == ["import"]:
+        ledger = Ledger()
+        print(f"Imported {ledger.import_text_files()} accounts into {ledger.path}")
+    else:
+        print("Usage: python3 ledger.py import")
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from PyQt5.QtCore import QObject, pyqtSignal
+from ledger import LEDGER_PATH, Ledger, LedgerError, from_cents, to_cents
+from metrics import metrics
+
+# Milliseconds a posting may wait for others to share its commit, e.g.
+# FACEPOS_LEDGER_COMMIT_WINDOW=20 trades up to 20 ms of latency for fewer fsyncs
+COMMIT_WINDOW_ENV = "FACEPOS_LEDGER_COMMIT_WINDOW"
+
+
+class LedgerWriter(threading.Thread):
+    # Group commit for the ledger postings of one process. The UI queues postings and gets
+    # a Future back right away; this thread collects whatever arrives within the commit
+    # window (up to max_batch) and applies it as one transaction, so no ledger I/O happens
+    # on the UI thread. Every commit runs with synchronous=FULL, so a Future only resolves
+    # once its posting survives a power loss; a group pays one fsync for all its postings.
+    # After a crash SQLite replays the committed transactions from the WAL; postings still
+    # queued were never acknowledged.
+    # Every process runs its own writer, so only postings from the same process share a
+    # commit (the checkout's lanes do), while separate terminal processes still take
+    # SQLite's write lock one transaction at a time.
+    def __init__(self, path=LEDGER_PATH, window=None, max_batch=500):
+        super().__init__(daemon=True)
+        self.path = path
+        if window is None:
+            window = float(os.environ.get(COMMIT_WINDOW_ENV, "5")) / 1000
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+
+    def post(self, debit_account, credit_account, amount, operation, allow_negative=False):
+        # Resolves to {account: new balance} for the accounts involved, or raises the
+        # LedgerError that declined the posting
+        future = Future()
+        try:
+            cents = to_cents(amount)
+        except (OverflowError, TypeError, ValueError):
+            future.set_exception(ValueError(f"Invalid posting amount: {amount!r}"))
+            return future
+        if cents < 0:
+            future.set_exception(ValueError("Posting amount must not be negative"))
+            return future
+        self.queue.put(((debit_account, credit_account, cents, operation, allow_negative), future))
+        return future
+
+    def transfer(self, from_account, to_account, amount, operation="transfer"):
+        return self.post(from_account, to_account, amount, operation)
+
+    def adjust(self, account_id, amount, operation="adjust", allow_negative=True):
+        # Same semantics as Ledger.adjust: a negative amount debits the account
+        if not amount < 0:
+            return self.post(None, account_id, amount, operation)
+        return self.post(account_id, None, -amount, operation, allow_negative)
+
+    def run(self):
+        try:
+            ledger = Ledger(self.path)
+        except Exception as e:
+            # Keep answering, so nothing queued now or later waits forever
+            error = LedgerError(f"Cannot open the ledger: {e}")
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                item[1].set_exception(error)
+        ledger.connection.execute("PRAGMA synchronous=FULL")
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.commit(ledger, batch)
+            if stopping:
+                break
+        ledger.close()
+
+    def commit(self, ledger, batch):
+        metrics.observe("ledger_group_size", len(batch), [1, 2, 5, 10, 20, 50, 100, 200, 500])
+        try:
+            errors = ledger.post_many([posting for posting, _ in batch])
+            accounts = {account for posting, _ in batch for account in posting[:2] if account is not None}
+            balances = ledger.balances(accounts)
+        except Exception as e:
+            # Busy timeouts, a full disk or I/O errors reach the UI as a LedgerError like
+            # any declined posting
+            error = e if isinstance(e, LedgerError) else LedgerError(f"Ledger write failed: {e}")
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        for (posting, future), error in zip(batch, errors):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result({account: balances.get(account, from_cents(0))
+                                   for account in posting[:2] if account is not None})
+
+    def stop(self):
+        # Commits everything queued so far before returning
+        self.queue.put(None)
+        self.join()
+
+
+class LedgerResults(QObject):
+    # Futures resolve on the writer thread, where no widget may be touched. This hands
+    # each finished Future to its handler on the thread that created the object, the UI
+    # thread, through a queued signal.
+    posted = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.posted.connect(self.dispatch)
+
+    def deliver(self, future, handler):
+        future.add_done_callback(lambda future: self.posted.emit(future, handler))
+
+    def dispatch(self, future, handler):
+        handler(future)
@@ -0,0 +1,200 @@
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+import time
+from ledger import InsufficientFunds, Ledger, business_account, from_cents, to_cents
+from metrics import summarize
+
+LOADGEN_PATH = "loadgen.db"
+OPERATIONS = ("purchase", "topup", "transfer")
+
+
+def run_terminal(args):
+    # One simulated till with its own ledger connection. Returns the latency of every
+    # operation and the balance change it expects on each account from the operations
+    # that succeeded, so the final balances can be checked for lost updates.
+    path, terminal, operations, mix, customers, businesses, hot_accounts, hot_share, seed = args
+    rng = random.Random(seed + terminal)
+    ledger = Ledger(path, balances_folder="", business_folder="")
+    latencies = {operation: [] for operation in OPERATIONS}
+    counts = {"ok": 0, "declined": 0, "error": 0}
+    deltas = {}
+    topup_cents = 0
+
+    def pick_customer():
+        if hot_accounts and rng.random() < hot_share:
+            return rng.choice(hot_accounts)
+        return rng.choice(customers)
+
+    for _ in range(operations):
+        operation = rng.choices(OPERATIONS, weights=mix)[0]
+        customer = pick_customer()
+        cents = rng.randint(100, 5000)
+        began = time.perf_counter()
+        try:
+            if operation == "purchase":
+                other = rng.choice(businesses)
+                ledger.transfer(customer, other, from_cents(cents), "purchase")
+            elif operation == "topup":
+                other = None
+                ledger.adjust(customer, from_cents(cents), "Add Money")
+                topup_cents += cents
+            else:
+                other = pick_customer()
+                while other == customer:
+                    other = rng.choice(customers)
+                ledger.transfer(customer, other, from_cents(cents), "transfer")
+        except InsufficientFunds:
+            counts["declined"] += 1
+            continue
+        except Exception as e:
+            counts["error"] += 1
+            print(f"Terminal {terminal}: {operation} failed: {e}")
+            continue
+        finally:
+            latencies[operation].append(time.perf_counter() - began)
+
+        counts["ok"] += 1
+        if other is None:
+            deltas[customer] = deltas.get(customer, 0) + cents
+        else:
+            deltas[customer] = deltas.get(customer, 0) - cents
+            deltas[other] = deltas.get(other, 0) + cents
+
+    ledger.close()
+    return latencies, counts, deltas, topup_cents
+
+
+class LedgerLoadTest:
+    # Replays a lunchtime mix of purchases, top-ups and transfers from many simulated
+    # terminals against a scratch ledger database, then checks the result: every account
+    # must end at its opening balance plus the changes of the operations that succeeded
+    # (anything else is a lost update), and money may only enter the system via top-ups.
+    def __init__(self, path=LOADGEN_PATH, terminals=8, operations=500, mix=(70, 15, 15), customers=1000,
+                 businesses=10, opening_balance=50.0, hot_accounts=0, hot_share=0.5, processes=False, seed=0):
+        if customers < 2:
+            # A transfer needs a recipient other than the paying customer
+            raise ValueError("The load test needs at least 2 customers")
+        self.path = path
+        self.terminals = terminals
+        self.operations = operations
+        self.mix = mix
+        self.customer_ids = [f"42{i:010d}" for i in range(customers)]
+        self.business_ids = [business_account(f"loadgen{i}") for i in range(businesses)]
+        self.opening_balance = opening_balance
+        self.hot_accounts = self.customer_ids[:hot_accounts]
+        self.hot_share = hot_share
+        self.processes = processes
+        self.seed = seed
+
+    def prepare(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        ledger = Ledger(self.path, balances_folder="", business_folder="")
+        with ledger.transaction() as connection:
+            connection.executemany("INSERT INTO accounts (id, kind, balance) VALUES (?, 'civilian', ?)",
+                                   [(account_id, to_cents(self.opening_balance)) for account_id in self.customer_ids])
+            connection.executemany("INSERT INTO accounts (id, kind, balance) VALUES (?, 'business', 0)",
+                                   [(account_id,) for account_id in self.business_ids])
+        opening = self.read_cents(ledger)
+        ledger.close()
+        return opening
+
+    def read_cents(self, ledger):
+        return dict(ledger.connection.execute("SELECT id, balance FROM accounts"))
+
+    def run(self):
+        opening = self.prepare()
+        jobs = [(self.path, terminal, self.operations, self.mix, self.customer_ids, self.business_ids,
+                 self.hot_accounts, self.hot_share, self.seed) for terminal in range(self.terminals)]
+
+        started = time.perf_counter()
+        if self.processes:
+            with multiprocessing.Pool(self.terminals) as pool:
+                results = pool.map(run_terminal, jobs)
+        else:
+            results = [None] * self.terminals
+
+            def run_thread(terminal):
+                results[terminal] = run_terminal(jobs[terminal])
+
+            threads = [threading.Thread(target=run_thread, args=(terminal,)) for terminal in range(self.terminals)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        ledger = Ledger(self.path, balances_folder="", business_folder="")
+        final = self.read_cents(ledger)
+        recorded = ledger.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        ledger.close()
+        return self.report(opening, final, recorded, results, elapsed)
+
+    def report(self, opening, final, recorded, results, elapsed):
+        latencies = {operation: [] for operation in OPERATIONS}
+        counts = {"ok": 0, "declined": 0, "error": 0}
+        expected = dict(opening)
+        topup_cents = 0
+        for terminal_latencies, terminal_counts, deltas, terminal_topups in results:
+            for operation, samples in terminal_latencies.items():
+                latencies[operation].extend(samples)
+            for outcome, count in terminal_counts.items():
+                counts[outcome] += count
+            for account_id, cents in deltas.items():
+                expected[account_id] += cents
+            topup_cents += terminal_topups
+
+        lost_updates = sum(1 for account_id, cents in expected.items() if final.get(account_id) != cents)
+        negative = sum(1 for cents in final.values() if cents < 0)
+        conserved = sum(final.values()) == sum(opening.values()) + topup_cents
+        total = counts["ok"] + counts["declined"] + counts["error"]
+
+        mode = "processes" if self.processes else "threads"
+        print(f"{self.terminals} terminals ({mode}), {total} operations in {elapsed:.2f}s: "
+              f"{total / elapsed:.1f} tx/s, {counts['ok']} committed, {counts['declined']} declined, "
+              f"{counts['error']} errors")
+        print(f"{'operation':<10} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for operation, samples in list(latencies.items()) + [("all", sum(latencies.values(), []))]:
+            summary = summarize(samples)
+            if summary["count"]:
+                print(f"{operation:<10} {summary['count']:>7} {summary['p50']:>9.2f} "
+                      f"{summary['p99']:>9.2f} {summary['max']:>9.2f}")
+        print(f"Lost updates: {lost_updates} accounts differ from their expected balance")
+        print(f"Transactions recorded: {recorded} (expected {counts['ok']})")
+        print(f"Negative balances: {negative}")
+        print(f"Balance conservation: {'OK' if conserved else 'FAILED'} "
+              f"(opening {from_cents(sum(opening.values())):.2f} + top-ups {from_cents(topup_cents):.2f}, "
+              f"final {from_cents(sum(final.values())):.2f})")
+        return {"tx_per_second": total / elapsed, "counts": counts, "lost_updates": lost_updates,
+                "recorded": recorded, "negative": negative, "conserved": conserved,
+                "latency": {operation: summarize(samples) for operation, samples in latencies.items()}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many FacePOS terminals hitting the ledger at once")
+    parser.add_argument("--db", default=LOADGEN_PATH, help="scratch database, recreated on every run")
+    parser.add_argument("--terminals", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=500, help="operations per terminal")
+    parser.add_argument("--mix", default="70,15,15", help="purchase,topup,transfer weights")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--businesses", type=int, default=10)
+    parser.add_argument("--opening-balance", type=float, default=50.0)
+    parser.add_argument("--hot-accounts", type=int, default=0,
+                        help="number of customers that get --hot-share of the traffic, to provoke contention")
+    parser.add_argument("--hot-share", type=float, default=0.5)
+    parser.add_argument("--processes", action="store_true", help="one process per terminal instead of threads")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.customers < 2:
+        parser.error("--customers must be at least 2")
+
+    load_test = LedgerLoadTest(args.db, args.terminals, args.operations, [int(w) for w in args.mix.split(",")],
+                               args.customers, args.businesses, args.opening_balance, args.hot_accounts,
+                               args.hot_share, args.processes, args.seed)
+    result = load_test.run()
+    if result["lost_updates"] or not result["conserved"] or result["negative"]:
+        raise SystemExit(1)
@@ -1,6 +1,10 @@
 import sys
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QMessageBox, QInputDialog, QLineEdit
 import os
+from accounts import BusinessDirectory, UsernameTaken
+from ledger import Ledger
+from metrics import metrics
+from startup import ModulePreloader, REPORT_ENV, startup_timer
 
 class SelectorWindow(QMainWindow):
     def __init__(self):
@@ -28,6 +32,13 @@ class SelectorWindow(QMainWindow):
 
         self.create_folders()  # Create necessary folders
 
+        # Editions run as windows in this process. Their modules (and with them OpenCV,
+        # dlib and face_recognition) are imported in the background while the user picks
+        # an edition and types credentials.
+        self.edition_window = None
+        self.preloader = ModulePreloader(["cv2", "imutils", "face_recognition", "bank", "business", "civilian"])
+        self.preloader.start()
+
     def select_business_edition(self):
         choice = QMessageBox.question(self, "Business Edition", "Do you already have a business?",
                                        QMessageBox.Yes | QMessageBox.No)
@@ -39,13 +50,21 @@ class SelectorWindow(QMainWindow):
     def select_bank_edition(self):
         username, password, ok = self.get_login_credentials("Bank Edition")
         if ok and username == "milo" and password == "milo":
-            os.system("python3 bank.py")
-            self.close()
+            from bank import POSApp
+            self.open_edition(POSApp)
         else:
             QMessageBox.warning(self, "Error", "Invalid credentials.")
 
     def select_civilian_edition(self):
-        os.system("python3 civilian.py")
+        from civilian import CivilianPOSApp
+        self.open_edition(CivilianPOSApp)
+
+    def open_edition(self, window_class):
+        startup_timer.mark(f"{window_class.__module__} selected and imported")
+        self.edition_window = window_class()
+        self.edition_window.show()
+        startup_timer.mark(f"{window_class.__module__} window shown")
+        startup_timer.report()
         self.close()
 
     def get_login_credentials(self, edition):
@@ -54,8 +73,8 @@ class SelectorWindow(QMainWindow):
         return username, password, ok1 and ok2
 
     def login_business(self):
-        os.system("python3 business.py")
-        self.close()
+        from business import BusinessPOSApp
+        self.open_edition(BusinessPOSApp)
 
     def register_business(self):
         business_name, ok = QInputDialog.getText(self, "Register Business", "Enter Business Name:")
@@ -63,10 +82,12 @@ class SelectorWindow(QMainWindow):
             username, ok1 = QInputDialog.getText(self, "Register Business", "Enter Username:")
             password, ok2 = QInputDialog.getText(self, "Register Business", "Enter Password:", QLineEdit.Password)
             if ok1 and ok2:
-                # Save business information to a file
-                business_file = os.path.join("business", f"{business_name}.txt")
-                with open(business_file, "w") as file:
-                    file.write(f"{business_name}\n{username}\n{password}\n0")  # Default balance is 0
+                # Save the login with a hashed password and open the business account (default balance is 0)
+                try:
+                    BusinessDirectory(Ledger()).register(business_name, username, password)
+                except UsernameTaken:
+                    QMessageBox.warning(self, "Error", "That username or business name is already registered.")
+                    return
                 QMessageBox.information(self, "Registration Successful", f"Business '{business_name}' registered successfully.")
 
     def create_folders(self):
@@ -78,7 +99,11 @@ class SelectorWindow(QMainWindow):
 
 
 if __name__ == "__main__":
+    if "--startup-report" in sys.argv:
+        os.environ[REPORT_ENV] = "1"
+    metrics.start()
     app = QApplication(sys.argv)
     selector_window = SelectorWindow()
     selector_window.show()
+    startup_timer.mark("selector shown")
     sys.exit(app.exec_())
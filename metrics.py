@@ -0,0 +1,197 @@
+import atexit
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# FACEPOS_METRICS_FILE=<path> rewrites a Prometheus text file every FACEPOS_METRICS_INTERVAL
+# seconds (node_exporter's textfile collector can pick it up), FACEPOS_METRICS_PORT=<port>
+# serves the same text on http://127.0.0.1:<port>/metrics. With neither set every call
+# below returns straight away.
+FILE_ENV = "FACEPOS_METRICS_FILE"
+PORT_ENV = "FACEPOS_METRICS_PORT"
+INTERVAL_ENV = "FACEPOS_METRICS_INTERVAL"
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+DISTANCE_BUCKETS = [0.1, 0.2, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.8, 1.0]
+
+
+def percentile(sorted_values, percent):
+    # Linear interpolation between closest ranks, same as numpy.percentile's default
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(samples):
+    # p50/p99/mean/max in milliseconds for a list of durations in seconds, for the
+    # benchmark and load generator reports
+    if not len(samples):
+        return {"count": 0, "p50": None, "p99": None, "mean": None, "max": None}
+    values = sorted(float(sample) * 1000 for sample in samples)
+    return {"count": len(values), "p50": percentile(values, 50), "p99": percentile(values, 99),
+            "mean": sum(values) / len(values), "max": values[-1]}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    # Times a with-block into the <name>_seconds histogram
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.began)
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Metrics:
+    # Counters and fixed-bucket histograms for the hot paths. Recording is a dict lookup,
+    # a bisect over a dozen buckets and an uncontended lock, a few hundred nanoseconds
+    # against frames that take tens of milliseconds. Nothing is formatted until export.
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.exporter = None
+        self.server = None
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def span(self, name):
+        # with metrics.span("update_camera"): ... records facepos_update_camera_seconds
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, f"{name}_seconds")
+
+    def render(self):
+        # Prometheus text exposition format
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                          for name, histogram in self.histograms.items()}
+        lines = []
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE facepos_{name}_total counter")
+            lines.append(f"facepos_{name}_total {value}")
+        for name, (buckets, counts, total, count) in sorted(histograms.items()):
+            lines.append(f"# TYPE facepos_{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f'facepos_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"facepos_{name}_sum {total}")
+            lines.append(f"facepos_{name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        # Written next to the target and renamed, so a scraper never reads half a file
+        with open(path + ".tmp", "w") as file:
+            file.write(self.render())
+        os.replace(path + ".tmp", path)
+
+    def start(self):
+        # Called once per process; reads the environment and starts the exporters
+        path = os.environ.get(FILE_ENV)
+        port = os.environ.get(PORT_ENV)
+        if self.enabled or not (path or port):
+            return
+        self.enabled = True
+        if path:
+            self.exporter = MetricsFileExporter(self, path, float(os.environ.get(INTERVAL_ENV, "10")))
+            self.exporter.start()
+        if port:
+            self.server = ThreadingHTTPServer(("127.0.0.1", int(port)), MetricsHandler)
+            self.server.metrics = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class MetricsFileExporter(threading.Thread):
+    def __init__(self, metrics, path, interval=10.0):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.metrics.write_file(self.path)
+        except OSError as e:
+            print(f"Writing metrics to {self.path} failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics = Metrics()
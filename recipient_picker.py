@@ -0,0 +1,102 @@
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QListView, QLabel, QDialogButtonBox
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+
+PAGE_SIZE = 100
+
+
+class RecipientModel(QAbstractListModel):
+    # The IDs matching the current prefix, fetched from the gallery's sorted ID index one
+    # page at a time as the view scrolls, so only the rows actually shown ever get loaded
+    def __init__(self, gallery, parent=None):
+        super().__init__(parent)
+        self.gallery = gallery
+        self.prefix = ""
+        self.total = 0
+        self.names = []
+
+    def set_prefix(self, prefix):
+        self.beginResetModel()
+        self.prefix = prefix
+        self.total, self.names = self.gallery.search(prefix, 0, PAGE_SIZE)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.names[index.row()]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.names) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        _, page = self.gallery.search(self.prefix, len(self.names), PAGE_SIZE)
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.names), len(self.names) + len(page) - 1)
+        self.names.extend(page)
+        self.endInsertRows()
+
+
+class RecipientPicker(QDialog):
+    # Type-ahead replacement for QInputDialog.getItem over every enrolled ID. Opens with the
+    # first page of IDs and narrows the list by prefix while the user types.
+    def __init__(self, gallery, title="Select recipient", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+
+        self.layout = QVBoxLayout(self)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("Type a customer ID")
+        self.layout.addWidget(self.search_edit)
+
+        self.model = RecipientModel(gallery, self)
+        self.list_view = QListView(self)
+        self.list_view.setModel(self.model)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.doubleClicked.connect(self.accept)
+        self.layout.addWidget(self.list_view)
+
+        self.count_label = QLabel(self)
+        self.layout.addWidget(self.count_label)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        self.layout.addWidget(self.buttons)
+
+        # Search once typing pauses rather than on every key, the gallery may sit in the
+        # recognition daemon behind a socket
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.update_matches)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+
+        self.update_matches()
+
+    def update_matches(self):
+        self.model.set_prefix(self.search_edit.text().strip())
+        self.count_label.setText(f"{self.model.total} matching customers")
+        if self.model.rowCount():
+            self.list_view.setCurrentIndex(self.model.index(0))
+
+    def selected_recipient(self):
+        if self.search_timer.isActive():
+            # Accepted before the pending search ran
+            self.search_timer.stop()
+            self.update_matches()
+        index = self.list_view.currentIndex()
+        return self.model.names[index.row()] if index.isValid() else None
+
+    @staticmethod
+    def get_recipient(parent, gallery, title="Transfer Money"):
+        # Same (recipient, ok) contract as QInputDialog.getItem
+        picker = RecipientPicker(gallery, title, parent)
+        if picker.exec_() != QDialog.Accepted:
+            return None, False
+        recipient = picker.selected_recipient()
+        return recipient, recipient is not None
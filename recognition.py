@@ -0,0 +1,44 @@
+import face_recognition
+from metrics import DISTANCE_BUCKETS, metrics
+
+
+class FaceRecognizer:
+    # Detect, encode and match faces against a gallery. With a track cache only tracks
+    # that need (re-)verification are encoded, everyone else keeps their cached identity.
+    def __init__(self, gallery, detector, track_cache=None):
+        self.gallery = gallery
+        self.detector = detector
+        self.track_cache = track_cache
+
+    def recognize(self, rgb_frame):
+        # Returns the face tracks in the frame, used by the live camera loop
+        with metrics.span("detect"):
+            face_locations = self.detector.detect(rgb_frame)
+        tracks = self.track_cache.update(face_locations)
+        metrics.count("faces_detected", len(face_locations))
+
+        stale_tracks = [track for track in tracks if self.track_cache.needs_verification(track)]
+        if stale_tracks:
+            with metrics.span("encode"):
+                face_encodings = face_recognition.face_encodings(rgb_frame, [track.box for track in stale_tracks])
+            with metrics.span("match"):
+                matches = self.gallery.match(face_encodings)
+            for track, match in zip(stale_tracks, matches):
+                self.track_cache.verify(track, match)
+                self.observe_match(match)
+        return tracks
+
+    def identify(self, rgb_frame):
+        # One-shot best match for the frame, or None if nobody known is in it
+        face_locations = self.detector.locate(rgb_frame)
+        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        match = self.gallery.best_match(face_encodings)
+        if match is not None:
+            self.observe_match(match)
+        return match
+
+    def observe_match(self, match):
+        # Distance to the closest gallery face, whether or not it was within tolerance
+        if match.distance != float("inf"):
+            metrics.observe("match_distance", match.distance, DISTANCE_BUCKETS)
+        metrics.count("faces_identified" if match.name is not None else "faces_unknown")
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import numpy as np
+from face_cache import CACHE_FOLDER, ENCODING_SIZE
+from gallery import DEFAULT_TOLERANCE, FaceGallery, FaceMatch
+from gallery_journal import GalleryWatcher
+from metrics import metrics
+
+SOCKET_PATH = os.path.join(CACHE_FOLDER, "recognition.sock")
+
+# Storage for the gallery's encodings in the daemon and in editions that load the gallery
+# themselves, e.g. FACEPOS_GALLERY_DTYPE=int8 keeps a quarter of the float32 memory per face
+DTYPE_ENV = "FACEPOS_GALLERY_DTYPE"
+
+
+def send_message(sock, header, payload=b""):
+    # A message is a 4-byte length, a JSON header and an optional binary payload whose
+    # size is given in the header
+    header = dict(header, payload_size=len(payload))
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack(">I", len(data)) + data + payload)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    (header_size,) = struct.unpack(">I", recv_exactly(sock, 4))
+    header = json.loads(recv_exactly(sock, header_size))
+    payload = recv_exactly(sock, header["payload_size"]) if header["payload_size"] else b""
+    return header, payload
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array)
+    return {"shape": list(array.shape), "dtype": str(array.dtype)}, array.tobytes()
+
+
+def decode_array(header, payload):
+    return np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+
+
+class RecognitionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        daemon = self.server.recognition_daemon
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, struct.error):
+                return
+            try:
+                reply, reply_payload = daemon.dispatch(header, payload)
+            except Exception as e:
+                reply, reply_payload = {"error": str(e)}, b""
+            send_message(self.request, reply, reply_payload)
+
+
+class RecognitionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RecognitionDaemon:
+    # One long-running process owns the gallery (and optionally the camera) for every
+    # edition on this machine. Editions talk to it through RemoteGallery and
+    # RemoteVideoStream, so the gallery is loaded and held in memory only once.
+    def __init__(self, faces_folder="faces", socket_path=SOCKET_PATH, camera=False, dtype=None, source=None):
+        self.socket_path = socket_path
+        dtype = dtype or os.environ.get(DTYPE_ENV) or "float32"
+        self.gallery = FaceGallery.load(faces_folder, dtype=dtype)
+        self.gallery_watcher = GalleryWatcher(self.gallery, faces_folder)
+        self.video_stream = None
+        if camera:
+            from frame_source import open_frame_source
+            self.video_stream = open_frame_source(source)
+
+    def dispatch(self, header, payload):
+        op = header["op"]
+        if op == "ping":
+            return {"ok": True, "camera": self.video_stream is not None, "tolerance": self.gallery.tolerance}, b""
+        if op == "names":
+            return {"names": self.gallery.names}, b""
+        if op == "search":
+            total, names = self.gallery.search(header["prefix"], header["start"], header["limit"])
+            return {"total": total, "names": names}, b""
+        if op == "size":
+            return {"size": len(self.gallery)}, b""
+        if op == "contains":
+            return {"contains": header["name"] in self.gallery}, b""
+        if op == "match":
+            encodings = decode_array(header, payload)
+            matches = self.gallery.match(encodings, exact=header.get("exact", False))
+            return {"matches": [list(match) for match in matches]}, b""
+        if op == "add":
+            self.gallery.add(header["name"], decode_array(header, payload))
+            return {"ok": True}, b""
+        if op == "remove":
+            return {"removed": self.gallery.remove(header["name"])}, b""
+        if op == "frame":
+            if self.video_stream is None:
+                raise ValueError("Daemon was started without a camera")
+            frame = self.video_stream.read()
+            if frame is None:
+                return {"frame": None}, b""
+            frame_header, frame_payload = encode_array(frame)
+            return dict(frame_header, frame=True), frame_payload
+        raise ValueError(f"Unknown request: {op}")
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = RecognitionServer(self.socket_path, RecognitionHandler)
+        server.recognition_daemon = self
+        self.gallery_watcher.start()
+        print(f"Serving {len(self.gallery)} faces ({self.gallery.nbytes / 1e6:.1f} MB) on {self.socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.gallery_watcher.stop()
+            if self.video_stream is not None:
+                self.video_stream.stop()
+            os.remove(self.socket_path)
+
+
+class RecognitionClient:
+    def __init__(self, socket_path=SOCKET_PATH, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def request(self, header, payload=b""):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self.sock.settimeout(self.timeout)
+                        self.sock.connect(self.socket_path)
+                    send_message(self.sock, header, payload)
+                    reply, reply_payload = recv_message(self.sock)
+                    break
+                except OSError:
+                    # Reconnect once, the daemon may have been restarted
+                    self.close()
+                    if attempt:
+                        raise
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply, reply_payload
+
+    def ping(self):
+        try:
+            return self.request({"op": "ping"})[0]
+        except (OSError, RuntimeError):
+            return None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class RemoteGallery:
+    # Stand-in for FaceGallery that forwards matching to the recognition daemon
+    def __init__(self, client, tolerance=DEFAULT_TOLERANCE):
+        self.client = client
+        self.tolerance = tolerance
+
+    @property
+    def names(self):
+        return self.client.request({"op": "names"})[0]["names"]
+
+    def __len__(self):
+        return self.client.request({"op": "size"})[0]["size"]
+
+    def __contains__(self, name):
+        return self.client.request({"op": "contains", "name": name})[0]["contains"]
+
+    def search(self, prefix="", start=0, limit=100):
+        reply = self.client.request({"op": "search", "prefix": prefix, "start": start, "limit": limit})[0]
+        return reply["total"], reply["names"]
+
+    def match(self, face_encodings, exact=False):
+        if len(face_encodings) == 0:
+            return []
+        encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        header, payload = encode_array(encodings)
+        reply = self.client.request(dict(header, op="match", exact=exact), payload)[0]
+        return [FaceMatch(*match) for match in reply["matches"]]
+
+    def best_match(self, face_encodings, exact=False):
+        matches = [match for match in self.match(face_encodings, exact) if match.name is not None]
+        if not matches:
+            return None
+        return min(matches, key=lambda match: match.distance)
+
+    def add(self, name, encoding):
+        header, payload = encode_array(np.asarray(encoding, dtype=np.float32))
+        self.client.request(dict(header, op="add", name=name), payload)
+
+    def remove(self, name):
+        return self.client.request({"op": "remove", "name": name})[0]["removed"]
+
+
+class RemoteVideoStream:
+    # Same read/start/stop interface as imutils' VideoStream, frames come from the daemon
+    def __init__(self, client):
+        self.client = client
+
+    def start(self):
+        return self
+
+    def read(self):
+        header, payload = self.client.request({"op": "frame"})
+        if not header.get("frame"):
+            return None
+        return decode_array(header, payload).copy()
+
+    def stop(self):
+        self.client.close()
+
+
+def open_gallery(faces_folder="faces", socket_path=SOCKET_PATH, dtype=None):
+    # Use the daemon's gallery when one is running, otherwise load a local gallery and
+    # follow the change journal. Returns the gallery and its watcher (None when remote).
+    # dtype None uses FACEPOS_GALLERY_DTYPE and falls back to float32.
+    client = RecognitionClient(socket_path)
+    status = client.ping()
+    if status is not None:
+        return RemoteGallery(client, status["tolerance"]), None
+    dtype = dtype or os.environ.get(DTYPE_ENV) or "float32"
+    gallery = FaceGallery.load(faces_folder, dtype=dtype)
+    gallery_watcher = GalleryWatcher(gallery, faces_folder)
+    gallery_watcher.start()
+    return gallery, gallery_watcher
+
+
+def open_video_stream(socket_path=SOCKET_PATH):
+    client = RecognitionClient(socket_path)
+    status = client.ping()
+    if status is not None and status["camera"]:
+        return RemoteVideoStream(client)
+    from frame_source import open_frame_source
+    return open_frame_source()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared FacePOS recognition service")
+    parser.add_argument("--faces", default="faces")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--camera", action="store_true", help="own the camera and serve frames to the editions")
+    parser.add_argument("--source", default=None, help="camera index, video file or image folder to serve "
+                                                        "instead of the first webcam")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default=None,
+                        help="storage for the encodings, float16/int8 trade a little accuracy for memory; "
+                             "defaults to FACEPOS_GALLERY_DTYPE, then float32")
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(args.socket) or ".", exist_ok=True)
+    metrics.start()
+    RecognitionDaemon(args.faces, args.socket, args.camera, args.dtype, args.source).serve_forever()
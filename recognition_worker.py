@@ -0,0 +1,63 @@
+import threading
+import time
+from PyQt5.QtCore import QThread, pyqtSignal
+from metrics import metrics
+
+
+class RecognitionWorker(QThread):
+    # Runs the recognize callable on a background thread. Only the newest submitted frame
+    # is kept, anything that arrives while recognition is busy replaces the pending frame,
+    # so the worker never falls behind the camera. release, when given, is called with
+    # every frame the worker is done with, recognized or dropped, so pooled frame buffers
+    # can be reused.
+    faces_recognized = pyqtSignal(list)
+
+    def __init__(self, recognize, parent=None, release=None):
+        super().__init__(parent)
+        self.recognize = recognize
+        self.release = release
+        self.condition = threading.Condition()
+        self.pending_frame = None
+        self.running = True
+        self.frames_dropped = 0
+        # Smoothed time one recognition takes, lets the caller pace its submissions
+        self.recognition_seconds = 0.0
+
+    def submit(self, frame):
+        with self.condition:
+            dropped_frame = self.pending_frame
+            if dropped_frame is not None:
+                self.frames_dropped += 1
+                metrics.count("frames_dropped")
+            self.pending_frame = frame
+            self.condition.notify()
+        if dropped_frame is not None and self.release is not None:
+            self.release(dropped_frame)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_frame is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame = self.pending_frame
+                self.pending_frame = None
+
+            began = time.perf_counter()
+            try:
+                recognized_faces = self.recognize(frame)
+            except Exception as e:
+                print(f"Recognition failed: {e}")
+                continue
+            finally:
+                if self.release is not None:
+                    self.release(frame)
+                self.recognition_seconds = 0.8 * self.recognition_seconds + 0.2 * (time.perf_counter() - began)
+            self.faces_recognized.emit(recognized_faces)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
@@ -0,0 +1,94 @@
+import argparse
+import csv
+import sys
+from ledger import LEDGER_PATH, Ledger, from_cents
+
+EXPORT_FIELDS = ["account", "kind", "balance"]
+
+
+class LedgerReport:
+    # Bank-wide figures read from the aggregate tables the ledger's triggers maintain, so
+    # every answer is a lookup of a handful of rows however many accounts there are
+    def __init__(self, ledger=None):
+        self.ledger = ledger or Ledger()
+
+    def totals(self):
+        # {kind: {"accounts", "nonzero", "total"}} for civilian and business accounts
+        rows = self.ledger.connection.execute("SELECT kind, accounts, nonzero, total FROM account_totals")
+        return {kind: {"accounts": accounts, "nonzero": nonzero, "total": from_cents(total)}
+                for kind, accounts, nonzero, total in rows}
+
+    def total_deposits(self):
+        return self.totals().get("civilian", {}).get("total", from_cents(0))
+
+    def nonzero_accounts(self, kind=None):
+        return sum(totals["nonzero"] for account_kind, totals in self.totals().items()
+                   if kind is None or account_kind == kind)
+
+    def top_merchants(self, limit=10):
+        # [(business name, amount received, payments)] by amount received, read in order
+        # from the index on merchant_totals
+        rows = self.ledger.connection.execute(
+            "SELECT account_id, received, payments FROM merchant_totals ORDER BY received DESC LIMIT ?", (limit,))
+        return [(account_id[len("business:"):], from_cents(received), payments)
+                for account_id, received, payments in rows]
+
+    def export(self, file, kind=None):
+        # Writes every account as CSV in one pass over the accounts table in storage order.
+        # Rows are streamed from a single statement, which reads one consistent snapshot of
+        # the ledger while terminals keep posting. Returns the number of accounts written.
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_FIELDS)
+        if kind is None:
+            cursor = self.ledger.connection.execute("SELECT id, kind, balance FROM accounts")
+        else:
+            cursor = self.ledger.connection.execute("SELECT id, kind, balance FROM accounts WHERE kind = ?", (kind,))
+        exported = 0
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return exported
+            writer.writerows((account_id, account_kind, f"{from_cents(cents):.2f}")
+                             for account_id, account_kind, cents in rows)
+            exported += len(rows)
+
+    def verify(self):
+        # Recomputes the account totals with a full scan, returns the kinds whose stored
+        # aggregates disagree (empty when everything matches)
+        rows = self.ledger.connection.execute(
+            "SELECT kind, COUNT(*), SUM(balance != 0), SUM(balance) FROM accounts GROUP BY kind")
+        scanned = {kind: {"accounts": accounts, "nonzero": nonzero, "total": from_cents(total)}
+                   for kind, accounts, nonzero, total in rows}
+        stored = {kind: totals for kind, totals in self.totals().items() if totals["accounts"]}
+        return sorted(kind for kind in set(scanned) | set(stored) if scanned.get(kind) != stored.get(kind))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bank-wide FacePOS figures and account export")
+    parser.add_argument("command", choices=["summary", "merchants", "export", "verify"])
+    parser.add_argument("--db", default=LEDGER_PATH)
+    parser.add_argument("--limit", type=int, default=10, help="number of merchants to list")
+    parser.add_argument("--kind", choices=["civilian", "business"], default=None, help="export one kind only")
+    parser.add_argument("--output", default="-", help="export CSV, - for standard output")
+    args = parser.parse_args()
+
+    report = LedgerReport(Ledger(args.db))
+    if args.command == "summary":
+        for kind, totals in sorted(report.totals().items()):
+            print(f"{kind}: {totals['accounts']} accounts, {totals['nonzero']} with a balance, "
+                  f"total ${totals['total']:.2f}")
+    elif args.command == "merchants":
+        for rank, (business_name, received, payments) in enumerate(report.top_merchants(args.limit), 1):
+            print(f"{rank}. {business_name}: ${received:.2f} from {payments} payments")
+    elif args.command == "export":
+        output = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+        exported = report.export(output, args.kind)
+        if output is not sys.stdout:
+            output.close()
+        print(f"Exported {exported} accounts", file=sys.stderr)
+    else:
+        mismatched = report.verify()
+        if mismatched:
+            print(f"Aggregates out of date for: {', '.join(mismatched)}")
+            sys.exit(1)
+        print("Aggregates match the accounts")
@@ -8,4 +8,29 @@ curl -O https://raw.githubusercontent.com/school497/facepos/main/main.py
 curl -O https://raw.githubusercontent.com/school497/facepos/main/civilian.py
 curl -O https://raw.githubusercontent.com/school497/facepos/main/business.py
 curl -O https://raw.githubusercontent.com/school497/facepos/main/bank.py 
+curl -O https://raw.githubusercontent.com/school497/facepos/main/checkout.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/accounts.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/benchmark.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/enroll.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/face_cache.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/detection.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/face_index.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/frame_buffers.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/frame_scheduler.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/frame_source.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/gallery.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/gallery_journal.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/lanes.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/ledger.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/ledger_writer.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/loadgen.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/metrics.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/recipient_picker.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/reports.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/recognition.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/recognition_daemon.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/recognition_worker.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/startup.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/track_cache.py
+curl -O https://raw.githubusercontent.com/school497/facepos/main/transaction_engine.py
 python3 ~/Applications/FacePOS/main.py
@@ -0,0 +1,63 @@
+import importlib
+import os
+import threading
+import time
+
+# Set FACEPOS_STARTUP_REPORT=1 (or run main.py --startup-report) to print where startup time goes
+REPORT_ENV = "FACEPOS_STARTUP_REPORT"
+
+
+class StartupTimer:
+    # Collects (stage, seconds since process start, seconds since previous mark) so a slow
+    # startup can be broken down into imports, gallery loading, camera start and so on
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        with self.lock:
+            self.stages.append((stage, now - self.start, now - self.last))
+            self.last = now
+
+    def record(self, stage, duration):
+        # For work measured separately, e.g. imports on the preload thread
+        with self.lock:
+            self.stages.append((stage, time.perf_counter() - self.start, duration))
+
+    def enabled(self):
+        return os.environ.get(REPORT_ENV) == "1"
+
+    def report(self):
+        if not self.enabled():
+            return
+        with self.lock:
+            stages = list(self.stages)
+        print("Startup time report")
+        print(f"{'stage':<40} {'at (s)':>8} {'took (s)':>9}")
+        for stage, at, took in stages:
+            print(f"{stage:<40} {at:>8.3f} {took:>9.3f}")
+
+
+startup_timer = StartupTimer()
+
+
+class ModulePreloader(threading.Thread):
+    # Imports modules on a background thread, e.g. the editions (and with them OpenCV, dlib
+    # and face_recognition) while the user is still typing credentials in the selector.
+    # A later import on the main thread returns the module as soon as it has finished.
+    def __init__(self, module_names):
+        super().__init__(daemon=True)
+        self.module_names = module_names
+
+    def run(self):
+        for name in self.module_names:
+            began = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Preloading {name} failed: {e}")
+                continue
+            startup_timer.record(f"preload {name}", time.perf_counter() - began)
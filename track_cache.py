@@ -0,0 +1,105 @@
+import threading
+import time
+
+
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    overlap = max(bottom - top, 0) * max(right - left, 0)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - overlap
+    return overlap / union if union > 0 else 0.0
+
+
+def box_area(box):
+    return max(box[2] - box[0], 0) * max(box[1] - box[3], 0)
+
+
+class FaceTrack:
+    def __init__(self, box):
+        self.box = box
+        self.name = None
+        self.distance = None
+        self.confidence = 0.0
+        self.frames_since_verified = 0
+        self.updated_at = time.monotonic()
+
+
+class TrackIdentityCache:
+    # Remembers who each face track is, so a customer standing at the till is encoded once
+    # instead of on every frame. A box continues a track when it overlaps the previous box
+    # by at least min_iou and its area changed by less than max_size_change. A track is
+    # re-verified when it has no confident identity, when its confidence has decayed below
+    # min_confidence, or every reverify_every frames regardless.
+    def __init__(self, tolerance=0.6, min_iou=0.4, max_size_change=0.35, confidence_decay=0.98,
+                 min_confidence=0.35, reverify_every=60, max_age=1.0):
+        self.tolerance = tolerance
+        self.min_iou = min_iou
+        self.max_size_change = max_size_change
+        self.confidence_decay = confidence_decay
+        self.min_confidence = min_confidence
+        self.reverify_every = reverify_every
+        self.max_age = max_age
+        self.tracks = []
+        self.lock = threading.Lock()
+
+    def update(self, boxes):
+        # Associate this frame's boxes with the existing tracks, returns one track per box
+        now = time.monotonic()
+        with self.lock:
+            previous = list(self.tracks)
+            tracks = []
+            for box in boxes:
+                track = self.find_track(previous, box)
+                if track is None:
+                    track = FaceTrack(box)
+                else:
+                    previous.remove(track)
+                    track.box = box
+                    track.frames_since_verified += 1
+                    track.confidence *= self.confidence_decay
+                track.updated_at = now
+                tracks.append(track)
+            self.tracks = tracks
+        return tracks
+
+    def find_track(self, tracks, box):
+        best, best_iou = None, self.min_iou
+        for track in tracks:
+            iou = box_iou(track.box, box)
+            old_area = box_area(track.box)
+            if iou < best_iou or not old_area:
+                continue
+            if abs(box_area(box) - old_area) / old_area > self.max_size_change:
+                continue
+            best, best_iou = track, iou
+        return best
+
+    def needs_verification(self, track):
+        return (track.name is None
+                or track.confidence < self.min_confidence
+                or track.frames_since_verified >= self.reverify_every)
+
+    def verify(self, track, match):
+        track.frames_since_verified = 0
+        if match.name is None:
+            track.name, track.distance, track.confidence = None, match.distance, 0.0
+            return
+        track.name = match.name
+        track.distance = match.distance
+        track.confidence = max(0.0, 1.0 - match.distance / self.tolerance)
+
+    def identified(self):
+        # Most confident identified track that was seen recently, or None
+        now = time.monotonic()
+        with self.lock:
+            tracks = [track for track in self.tracks
+                      if track.name is not None and now - track.updated_at <= self.max_age]
+        if not tracks:
+            return None
+        return max(tracks, key=lambda track: track.confidence)
+
+    def clear(self):
+        with self.lock:
+            self.tracks = []
@@ -0,0 +1,174 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+from enroll import encode_job
+from ledger import InsufficientFunds, Ledger, UnknownAccount, to_cents
+
+RESULT_FIELDS = ["index", "customer", "counterparty", "amount", "status", "error"]
+
+
+def read_records(path):
+    # Streams dict records from a CSV file with a header row or from JSON lines
+    # ("-" reads standard input); columns are customer or image, amount, counterparty
+    # and optionally operation
+    file = sys.stdin if path == "-" else open(path, "r", newline="")
+    try:
+        first_line = file.readline()
+        if first_line.lstrip().startswith("{"):
+            for line in itertools.chain([first_line], file):
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(itertools.chain([first_line], file))
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+class TransactionEngine:
+    # Settles transactions without any UI. Every record names the paying customer either
+    # by account ID or by a photo, an amount and a counterparty account; records without a
+    # counterparty credit (positive amount) or debit (negative amount) the customer alone.
+    # Unlike the bank edition's Transaction button, which lets a balance go negative, a
+    # debit or transfer that exceeds the balance is never posted and gets the status
+    # "declined". Records are processed in groups of batch_size: the photos of a group are
+    # encoded across a process pool and matched against the gallery with one search, then
+    # all postings of the group are committed in a single ledger transaction. Every result
+    # has one status: ok, declined, invalid, unknown_account, no_face, unrecognized or error.
+    def __init__(self, ledger=None, gallery=None, batch_size=1000, workers=None, faces_folder="faces"):
+        self.ledger = ledger or Ledger()
+        self.gallery = gallery
+        self.batch_size = batch_size
+        self.workers = workers or multiprocessing.cpu_count()
+        self.faces_folder = faces_folder
+        self.pool = None
+        self.counts = {}
+
+    def process(self, records):
+        # Yields one result dict per record, in input order
+        index = 0
+        records = iter(records)
+        try:
+            while True:
+                batch = list(itertools.islice(records, self.batch_size))
+                if not batch:
+                    return
+                for result in self.process_batch(batch, index):
+                    self.counts[result["status"]] = self.counts.get(result["status"], 0) + 1
+                    yield result
+                index += len(batch)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+
+    def process_batch(self, batch, first_index):
+        results = []
+        for offset, record in enumerate(batch):
+            result = {"index": first_index + offset, "customer": record.get("customer") or None,
+                      "counterparty": record.get("counterparty") or None, "amount": record.get("amount"),
+                      "status": None, "error": ""}
+            try:
+                result["cents"] = to_cents(record["amount"])
+            except (KeyError, OverflowError, TypeError, ValueError):
+                result["status"], result["error"] = "invalid", "missing or malformed amount"
+            if result["status"] is None and result["customer"] is None and not record.get("image"):
+                result["status"], result["error"] = "invalid", "no customer or image"
+            results.append(result)
+
+        self.identify(batch, results)
+
+        postings, posted = [], []
+        for record, result in zip(batch, results):
+            if result["status"] is not None:
+                continue
+            cents = result["cents"]
+            operation = record.get("operation") or ("purchase" if result["counterparty"] else "adjust")
+            if result["counterparty"] is not None:
+                if cents < 0:
+                    result["status"], result["error"] = "invalid", "negative transfer amount"
+                    continue
+                postings.append((result["customer"], result["counterparty"], cents, operation, False))
+            elif cents >= 0:
+                postings.append((None, result["customer"], cents, operation, False))
+            else:
+                postings.append((result["customer"], None, -cents, operation, False))
+            posted.append(result)
+
+        if postings:
+            for result, error in zip(posted, self.ledger.post_many(postings)):
+                if error is None:
+                    result["status"] = "ok"
+                elif isinstance(error, InsufficientFunds):
+                    result["status"], result["error"] = "declined", "insufficient funds"
+                elif isinstance(error, UnknownAccount):
+                    result["status"], result["error"] = "unknown_account", str(error)
+                else:
+                    result["status"], result["error"] = "error", str(error)
+
+        for result in results:
+            result.pop("cents", None)
+        return results
+
+    def identify(self, batch, results):
+        # Resolves the customer of every record that only has a photo
+        jobs = [(record["image"], record["image"]) for record, result in zip(batch, results)
+                if result["status"] is None and result["customer"] is None]
+        if not jobs:
+            return
+        if self.gallery is None:
+            from gallery import FaceGallery
+            self.gallery = FaceGallery.load(self.faces_folder)
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+
+        encoded = {}
+        for source_path, _, encoding, error in self.pool.imap(encode_job, jobs, chunksize=8):
+            encoded[source_path] = (encoding, error)
+        with_face = [path for path, (encoding, _) in encoded.items() if encoding is not None]
+        matches = dict(zip(with_face, self.gallery.match([encoded[path][0] for path in with_face])))
+
+        for record, result in zip(batch, results):
+            if result["status"] is not None or result["customer"] is not None:
+                continue
+            encoding, error = encoded[record["image"]]
+            if error is not None:
+                result["status"], result["error"] = "error", error
+            elif encoding is None:
+                result["status"], result["error"] = "no_face", "no face found in the image"
+            elif matches[record["image"]].name is None:
+                result["status"], result["error"] = "unrecognized", "face does not match any customer"
+            else:
+                result["customer"] = matches[record["image"]].name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Settle a batch of FacePOS transactions without the UI")
+    parser.add_argument("input", help="CSV with a header row or JSON lines, - for standard input")
+    parser.add_argument("--output", default="-", help="CSV of per-record results, - for standard output")
+    parser.add_argument("--db", default="ledger.db")
+    parser.add_argument("--faces", default="faces")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    engine = TransactionEngine(Ledger(args.db), batch_size=args.batch_size, workers=args.workers,
+                               faces_folder=args.faces)
+    output = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    writer = csv.DictWriter(output, fieldnames=RESULT_FIELDS)
+    writer.writeheader()
+    started = time.perf_counter()
+    processed = 0
+    for result in engine.process(read_records(args.input)):
+        writer.writerow(result)
+        processed += 1
+    elapsed = time.perf_counter() - started
+    if output is not sys.stdout:
+        output.close()
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(engine.counts.items()))
+    print(f"{processed} records in {elapsed:.2f}s ({processed / max(elapsed, 1e-9):.0f}/s): {summary}",
+          file=sys.stderr)